@@ -2,6 +2,7 @@
 
 import argparse as ap   # for commandline parameters
 import os               # for interacting with the os
+import stat             # for interpreting the mode bits returned by os.lstat
 import traceback        # for printing the traceback of an exception
 import csv              # for writing to csv files (verification file)
 import pwd              # for getting the name of the owner of a file/directory
@@ -9,6 +10,679 @@ import grp              # for getting the name of the group owning a file/direct
 import datetime         # for managing dates and time in a human-readable format
 import hashlib          # for hashing files
 import time             # for calculating the total amount of time that a certain mode takes
+import collections      # for the bounded queue of rows waiting for their digest
+import concurrent.futures # for hashing files in parallel
+import functools        # for caching the owner/group names
+import sqlite3          # for the indexed verification file format
+import threading        # for the per-thread read buffers
+import heapq            # for keeping the slowest files in the metrics
+import json             # for the metrics sidecar file
+import cProfile         # for the optional profiling of a run
+import ctypes           # for calling inotify (watch mode)
+import ctypes.util      # for finding the C library
+import select           # for waiting for inotify events
+import errno as errno_module # for recognizing the inotify watch limit
+import struct           # for decoding inotify events
+import tempfile         # for the directory digests of CSV verification files and the snapshots of tree comparison mode
+import shutil           # for appending the directory digests to a CSV verification file
+import zlib             # for assigning files to the shards of the scheduled verification
+import multiprocessing  # for the walker processes of the sharded scan
+import queue            # for the queue.Empty exception of the task queue of the sharded scan
+import fnmatch          # for the glob include/exclude rules of the walk
+import re               # for the regex include/exclude rules of the walk
+import pathlib          # for the URI of a verification file opened read-only
+
+# Position of the path and of the fingerprint columns inside a row of the verification file.
+# The fingerprint (inode, change time and modification time in nanoseconds) and the numeric owner
+# and group ids come after the path, so verification files written before them are still readable.
+PATH_COLUMN = 7
+INODE_COLUMN = 8
+CTIME_COLUMN = 9
+MTIME_COLUMN = 10
+UID_COLUMN = 11
+GID_COLUMN = 12
+# Digests of the blocks of the files hashed in blocks (see hash_file), separated by spaces; empty for the other entries
+BLOCKS_COLUMN = 13
+
+# Format of the last modification date time column
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S GMT+1"
+
+def format_mtime(mtime_ns : int) -> str:
+    '''Takes a modification time in nanoseconds since the epoch and returns it in the human-readable format of the verification file'''
+    return datetime.datetime.fromtimestamp(mtime_ns // 1_000_000_000).strftime(DATE_FORMAT)
+
+def parse_mtime(formatted_datetime : str) -> int:
+    '''Inverse of format_mtime (up to the second), used for verification files that only have the human-readable date'''
+    return int(time.mktime(time.strptime(formatted_datetime, DATE_FORMAT))) * 1_000_000_000
+
+# Prefix of the header cell that holds the walk options (symbolic link policy and filters, see WalkFilter) in JSON
+WALK_OPTIONS_HEADER = "Walk options "
+
+def verification_file_header(hash_name : str, walk_options : dict = None) -> list:
+    '''Returns the header row of a verification file whose digests are computed with hash_name.
+    The walk options, if given, are written in an extra cell at the end'''
+    header = ['Name', 'Size (B)', 'Owner', 'Group', 'Permission levels', 'Last modification date time', 'Hash ('+hash_name+')', 'Path',
+              'Inode', 'Change time (ns)', 'Modification time (ns)', 'Owner id', 'Group id', 'Block digests']
+    if walk_options is not None:
+        header.append(WALK_OPTIONS_HEADER + json.dumps(walk_options, sort_keys=True))
+    return header
+
+@functools.lru_cache(maxsize=None)
+def owner_name(uid : int) -> str:
+    '''Returns the name of the user with the given uid, or the uid itself if it has no name.
+    Every uid is looked up only once per run, since each lookup can be a round trip to NSS (LDAP, SSSD...)'''
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+@functools.lru_cache(maxsize=None)
+def group_name(gid : int) -> str:
+    '''Returns the name of the group with the given gid, or the gid itself if it has no name (cached like owner_name)'''
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+def path_sort_key(path : str, root_folder : str, is_dir : bool) -> tuple:
+    '''Returns the key that sorts the paths of root_folder in the same order in which walk_tree visits them:
+    a tuple with a (kind, name) pair per component of the path relative to root_folder, where kind is 0
+    for directories and 1 for files. Every ancestor is a directory, so only the last pair depends on is_dir'''
+    components = path[len(root_folder):].lstrip(os.sep).split(os.sep)
+    key = [(0, component) for component in components]
+    if not is_dir:
+        key[-1] = (1, components[-1])
+    return tuple(key)
+
+def row_is_dir(row : list) -> bool:
+    '''Returns True if the row of a verification file describes a directory (directories have no size)'''
+    return row[1] == ""
+
+def optional_int(row : list, column : int):
+    '''Returns the value of column as an integer, or None if the row doesn't have it'''
+    if len(row) <= column or row[column] in (None, ""):
+        return None
+    return int(row[column])
+
+def row_fingerprint(row : list):
+    '''Returns the ((size, inode, ctime_ns, mtime_ns), digest, block digests) of a file row of a verification file,
+    or None if the row has no fingerprint (directories and rows written before it was introduced)'''
+    if row_is_dir(row) or len(row) <= MTIME_COLUMN or row[INODE_COLUMN] == "":
+        return None
+    blocks = row[BLOCKS_COLUMN] if len(row) > BLOCKS_COLUMN else None
+    return (int(row[1]), int(row[INODE_COLUMN]), int(row[CTIME_COLUMN]), int(row[MTIME_COLUMN])), row[6], blocks or ""
+
+#------------ Verification file formats ------------
+# Every format reads and writes rows with the columns of verification_file_header. Rows that are read
+# back always hold strings, formatted as they are in the CSV file ("" for missing values).
+
+class CsvBaseline:
+    '''Verification file stored as a human-readable CSV file, the hash function is written in the header.
+    The rows of the entries are followed by the digests of the directories (see MerkleBuilder), one row per
+    directory in post-order with an empty name, the digest in the hash column and the path in the path column'''
+
+    extension = ".csv"
+
+    def __init__(self, path : str):
+        self.path = path
+
+    def read_hash_name(self) -> str:
+        '''Returns the name of the hash function, which is written inside brackets in the 7th column of the header'''
+        with open(self.path, "r", newline="") as f:
+            hash_column = next(csv.reader(f))[6]
+        return hash_column[hash_column.find("(") + 1 : hash_column.find(")")]
+
+    def read_walk_options(self) -> dict:
+        '''Returns the walk options the verification file has been created with, or None if it is older than them'''
+        with open(self.path, "r", newline="") as f:
+            header = next(csv.reader(f))
+        for cell in header[GID_COLUMN + 1:]:
+            if cell.startswith(WALK_OPTIONS_HEADER):
+                return json.loads(cell[len(WALK_OPTIONS_HEADER):])
+        return None
+
+    def rows(self):
+        '''Generator of the rows of the verification file, in the order in which they were written'''
+        with open(self.path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader) # skip the header
+            for row in reader:
+                if row[0] == "": # the directory digests start here
+                    return
+                yield row
+
+    def tree_digests(self):
+        '''Generator of the (path, digest) of every directory, in post-order (the root folder comes last).
+        Verification files written before the directory digests were introduced have none'''
+        with open(self.path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if row[0] == "":
+                    yield row[PATH_COLUMN], row[6]
+
+    def tree_index(self):
+        return CsvTreeIndex(self)
+
+    def create(self, hash_name : str, resume_position : int = None, walk_options : dict = None):
+        '''Creates the verification file and returns a writer for its rows (writerow/write_tree_digest/close).
+        If resume_position is given (see InitCheckpoint), the partial file of an interrupted run is continued instead'''
+        return CsvBaselineWriter(self.path, hash_name, resume_position, walk_options)
+
+    def fingerprints(self, root_folder : str):
+        '''Returns the fast verification lookup (get(path)/close()). A CSV file can only be read
+        sequentially, so the files must be asked for in walk order'''
+        return BaselineReader(self.rows(), root_folder)
+
+class CsvBaselineWriter:
+    '''Writer of a CSV verification file. The file is written with a .tmp suffix and renamed when it is closed'''
+
+    def __init__(self, path : str, hash_name : str, resume_position : int = None, walk_options : dict = None):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        if resume_position is None:
+            self.file = open(self.temp_path, "w", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(verification_file_header(hash_name, walk_options))
+        else: # drop whatever was written after the checkpoint
+            self.file = open(self.temp_path, "r+", newline="")
+            self.file.truncate(resume_position)
+            self.file.seek(resume_position)
+            self.writer = csv.writer(self.file)
+        # the directory digests are known while the rows are still being written, but they go after all of them
+        self.tree_file = tempfile.TemporaryFile("w+", newline="")
+        self.tree_writer = csv.writer(self.tree_file)
+
+    def writerow(self, row : list):
+        self.writer.writerow(row)
+
+    def write_tree_digest(self, path : str, digest : str):
+        self.tree_writer.writerow(["", "", "", "", "", "", digest, path])
+
+    def rows(self):
+        '''Generator of the rows that have been written so far (used to resume an interrupted run)'''
+        self.file.flush()
+        return CsvBaseline(self.temp_path).rows()
+
+    def checkpoint(self) -> int:
+        '''Makes sure that the rows written so far are on disk and returns the position to resume from'''
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def abort(self):
+        '''Closes the partial file without completing it, so that the run can be resumed'''
+        self.tree_file.close()
+        self.file.close()
+
+    def close(self):
+        self.tree_file.seek(0)
+        shutil.copyfileobj(self.tree_file, self.file)
+        self.tree_file.close()
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+class SqliteBaseline:
+    '''Verification file stored as an SQLite database. Timestamps and permissions are kept as integers
+    and digests as raw bytes, in a table indexed by path, so a single path can be looked up without
+    reading the whole file. The seq column keeps the walk order, the parent column (the path of the parent
+    directory) gives the content of a directory and the trees table holds the directory digests'''
+
+    extension = ".sqlite"
+    # number of rows inserted with a single executemany
+    batch_size = 10000
+
+    def __init__(self, path : str):
+        self.path = path
+        self.select = None
+
+    def connect(self) -> sqlite3.Connection:
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"\n {self.path} doesn't exist")
+        # the path is escaped, or a "#", "?" or "%" in it would open another file (and drop mode=ro)
+        return sqlite3.connect(pathlib.Path(os.path.abspath(self.path)).as_uri() + "?mode=ro", uri=True)
+
+    def read_hash_name(self) -> str:
+        with self.connect() as connection:
+            return connection.execute("SELECT value FROM meta WHERE key = 'hash_name'").fetchone()[0]
+
+    def read_walk_options(self) -> dict:
+        with self.connect() as connection:
+            record = connection.execute("SELECT value FROM meta WHERE key = 'walk_options'").fetchone()
+        return None if record is None else json.loads(record[0])
+
+    def rows(self):
+        connection = self.connect()
+        try:
+            cursor = connection.execute(self.select_entries(connection) + " ORDER BY seq")
+            for record in cursor:
+                yield self.to_row(record)
+        finally:
+            connection.close()
+
+    def tree_digests(self):
+        connection = self.connect()
+        try:
+            if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'trees'").fetchone() is None:
+                return # written before the directory digests were introduced
+            for path, digest in connection.execute("SELECT path, digest FROM trees ORDER BY seq"):
+                yield path, digest.hex()
+        finally:
+            connection.close()
+
+    def tree_index(self):
+        return SqliteTreeIndex(self)
+
+    def lookup(self, connection : sqlite3.Connection, path : str):
+        '''Returns the row of path, or None if it is not in the verification file'''
+        record = connection.execute(self.select_entries(connection) + " WHERE path = ?", (path,)).fetchone()
+        return None if record is None else self.to_row(record)
+
+    def select_entries(self, connection : sqlite3.Connection) -> str:
+        '''Returns the SELECT of the records of the entries table that to_row expects'''
+        if self.select is None:
+            # the blocks column is missing in the files written before the block digests were introduced
+            columns = [info[1] for info in connection.execute("PRAGMA table_info(entries)")]
+            self.select = ("SELECT name, size, owner, grp, mode, mtime_ns, digest, path, inode, ctime_ns, uid, gid, " +
+                           ("blocks" if "blocks" in columns else "NULL") + " FROM entries")
+        return self.select
+
+    @staticmethod
+    def to_row(record : tuple) -> list:
+        '''Formats a record of the entries table as a row of the verification file'''
+        name, size, owner, group, mode, mtime_ns, digest, path, inode, ctime_ns, uid, gid, blocks = record
+        return [name,
+                "" if size is None else str(size),
+                owner,
+                group,
+                oct(mode),
+                "" if mtime_ns is None else format_mtime(mtime_ns),
+                "" if digest is None else digest.hex(),
+                path,
+                "" if inode is None else str(inode),
+                "" if ctime_ns is None else str(ctime_ns),
+                "" if mtime_ns is None else str(mtime_ns),
+                "" if uid is None else str(uid),
+                "" if gid is None else str(gid),
+                "" if blocks is None else " ".join(blocks[i : i + len(digest)].hex() for i in range(0, len(blocks), len(digest)))]
+
+    def create(self, hash_name : str, resume_position : int = None, walk_options : dict = None):
+        return SqliteBaselineWriter(self.path, hash_name, self.batch_size, resume_position, walk_options)
+
+    def fingerprints(self, root_folder : str):
+        return SqliteFingerprints(self)
+
+class SqliteBaselineWriter:
+    '''Bulk writer of an SQLite verification file. The database is built in a temporary file, with the
+    path index created after all the rows have been inserted, and renamed when it is closed.
+    Rows are only committed by checkpoint() and close(), in write-ahead log mode, so an interrupted run
+    leaves the database as it was at its last checkpoint'''
+
+    def __init__(self, path : str, hash_name : str, batch_size : int, resume_position : int = None,
+                 walk_options : dict = None):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.batch_size = batch_size
+        self.batch = []
+        self.tree_batch = []
+        if resume_position is not None:
+            # drop whatever was written after the checkpoint; the directory digests are written again (see InitCheckpoint)
+            self.connection = sqlite3.connect(self.temp_path)
+            self.connection.execute("PRAGMA synchronous = FULL")
+            self.connection.execute("DELETE FROM entries WHERE seq > ?", (resume_position,))
+            self.connection.execute("DELETE FROM trees")
+            self.connection.commit()
+            return
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.temp_path + suffix):
+                os.remove(self.temp_path + suffix)
+        self.connection = sqlite3.connect(self.temp_path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = FULL") # only checkpoint() and close() commit
+        self.connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TABLE entries (seq INTEGER PRIMARY KEY, name TEXT, size INTEGER, owner TEXT, grp TEXT, "
+                                "mode INTEGER, mtime_ns INTEGER, digest BLOB, path TEXT NOT NULL, inode INTEGER, ctime_ns INTEGER, uid INTEGER, gid INTEGER, "
+                                "parent TEXT, blocks BLOB)")
+        self.connection.execute("CREATE TABLE trees (seq INTEGER PRIMARY KEY, path TEXT NOT NULL, digest BLOB)")
+        self.connection.execute("INSERT INTO meta VALUES ('hash_name', ?)", (hash_name,))
+        if walk_options is not None:
+            self.connection.execute("INSERT INTO meta VALUES ('walk_options', ?)", (json.dumps(walk_options, sort_keys=True),))
+        self.connection.commit()
+
+    def writerow(self, row : list):
+        '''Adds a row, given either with the values of scan_folder or with the strings of another verification file'''
+        size, digest = row[1], row[6]
+        blocks = row[BLOCKS_COLUMN] if len(row) > BLOCKS_COLUMN else None
+        mtime_ns = optional_int(row, MTIME_COLUMN)
+        if mtime_ns is None and row[5]: # older verification files only have the formatted date
+            mtime_ns = parse_mtime(row[5])
+        self.batch.append((row[0],
+                           None if size in (None, "") else int(size),
+                           row[2],
+                           row[3],
+                           int(row[4], 8),
+                           mtime_ns,
+                           bytes.fromhex(digest) if digest else None,
+                           row[PATH_COLUMN],
+                           optional_int(row, INODE_COLUMN),
+                           optional_int(row, CTIME_COLUMN),
+                           optional_int(row, UID_COLUMN),
+                           optional_int(row, GID_COLUMN),
+                           os.path.dirname(row[PATH_COLUMN]),
+                           bytes.fromhex(blocks.replace(" ", "")) if blocks else None))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_tree_digest(self, path : str, digest : str):
+        self.tree_batch.append((path, bytes.fromhex(digest)))
+        if len(self.tree_batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany("INSERT INTO entries (name, size, owner, grp, mode, mtime_ns, digest, path, inode, ctime_ns, uid, gid, parent, blocks) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.batch)
+        self.connection.executemany("INSERT INTO trees (path, digest) VALUES (?, ?)", self.tree_batch)
+        self.batch = []
+        self.tree_batch = []
+
+    def rows(self):
+        self.flush()
+        self.connection.commit()
+        return SqliteBaseline(self.temp_path).rows()
+
+    def checkpoint(self) -> int:
+        self.flush()
+        self.connection.commit()
+        return self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM entries").fetchone()[0]
+
+    def abort(self):
+        self.connection.close() # the uncommitted rows are rolled back
+
+    def close(self):
+        self.flush()
+        self.connection.execute("CREATE UNIQUE INDEX entries_path ON entries (path)")
+        self.connection.execute("CREATE INDEX entries_parent ON entries (parent, seq)")
+        self.connection.execute("CREATE UNIQUE INDEX trees_path ON trees (path)")
+        self.connection.commit()
+        self.connection.execute("PRAGMA journal_mode = DELETE") # a single file again
+        self.connection.close()
+        os.replace(self.temp_path, self.path)
+
+class SqliteFingerprints:
+    '''Fast verification lookup of an SQLite verification file, which uses the path index'''
+
+    def __init__(self, baseline : SqliteBaseline):
+        self.baseline = baseline
+        self.connection = baseline.connect()
+
+    def get(self, path : str):
+        row = self.baseline.lookup(self.connection, path)
+        return None if row is None else row_fingerprint(row)
+
+    def close(self):
+        self.connection.close()
+
+# Supported formats of the verification file
+BASELINE_FORMATS = {"csv": CsvBaseline, "sqlite": SqliteBaseline}
+
+def open_baseline(name : str, baseline_format : str = None):
+    '''Returns the verification file called name (without extension) in the given format.
+    If no format is given, it is detected from the verification files that exist'''
+    if baseline_format is None:
+        existing = [f for f, backend in BASELINE_FORMATS.items() if os.path.isfile(name + backend.extension)]
+        if len(existing) > 1:
+            raise Exception(f"There is more than one verification file called {name}, choose one with --baseline-format")
+        baseline_format = existing[0] if existing else "csv"
+    backend = BASELINE_FORMATS[baseline_format]
+    return backend(name + backend.extension)
+
+def convert_baseline(source, destination):
+    '''Copies every row of the source verification file, and its directory digests, into the destination one,
+    which can be in another format. It returns the number of rows that have been copied'''
+    writer = destination.create(source.read_hash_name(), walk_options=source.read_walk_options())
+    num_rows = 0
+    try:
+        for row in source.rows():
+            writer.writerow(row)
+            num_rows += 1
+        for path, digest in source.tree_digests():
+            writer.write_tree_digest(path, digest)
+    finally:
+        writer.close()
+    return num_rows
+
+class BaselineReader:
+    '''Reads the rows of a verification file one at a time, in the order in which they were written.
+    seek() moves forward to the row of a given path, so a live walk of the same root can be followed
+    with a single pass over the file and constant memory'''
+
+    def __init__(self, rows, root_folder : str):
+        self.reader = iter(rows)
+        self.root_folder = root_folder
+        self.advance()
+
+    def advance(self):
+        '''Moves to the next row; current becomes None at the end of the file'''
+        self.current = next(self.reader, None)
+        if self.current is None:
+            self.current_key = None
+        else:
+            self.current_key = path_sort_key(self.current[PATH_COLUMN], self.root_folder, row_is_dir(self.current))
+
+    def seek(self, key : tuple):
+        '''Skips (and yields) every row that comes before key; afterwards current is the row with that key,
+        if the verification file has one'''
+        while self.current is not None and self.current_key < key:
+            yield self.current
+            self.advance()
+
+    def get(self, path : str):
+        '''Fast verification lookup for the files of the live walk, which must be asked for in walk order.
+        Returns a ((size, inode, ctime_ns, mtime_ns), digest) tuple, or None if the file isn't in the verification
+        file or was written without a fingerprint (so that it is always re-hashed)'''
+        key = path_sort_key(path, self.root_folder, False)
+        for _ in self.seek(key):
+            pass
+        if self.current is None or self.current_key != key:
+            return None
+        return row_fingerprint(self.current)
+
+    def close(self):
+        if hasattr(self.reader, "close"): # rows read from a file
+            self.reader.close()
+
+class VerificationComparator:
+    '''Merge-join of the live walk against the verification file.
+    It is used in place of a csv.writer by scan_folder: every row of the live walk is received through
+    writerow(), in walk order, and compared with the row of the same path in the verification file.
+    Deleted, added and modified files/folders are printed (and written to the ChangeReport, if one is given) as
+    soon as they are found; nothing is kept in memory apart from the current row of the verification file.
+    If max_warnings is given, WarningLimitReached is raised as soon as that many warnings have been issued.
+    If the files have been hashed in blocks of block_size bytes, the byte ranges of a file whose blocks differ are
+    reported too'''
+
+    # (column, name) of the fields that are compared
+    FIELDS = [(1, "Size"), (2, "Owner"), (3, "Group"), (4, "Permission Levels"), (5, "Last Modification Date"), (6, "Hash")]
+    # the owner and the group are compared by numeric id, their names are only resolved when they have changed
+    ID_COLUMNS = {2: (UID_COLUMN, owner_name), 3: (GID_COLUMN, group_name)}
+    # the warnings are printed on the standard output
+    verbose = True
+
+    def __init__(self, baseline : BaselineReader, report = None, max_warnings : int = None, block_size : int = None):
+        self.baseline = baseline
+        self.report = report
+        self.max_warnings = max_warnings
+        self.block_size = block_size
+        self.num_deleted = 0
+        self.num_added = 0
+        self.num_modified = 0
+
+    def writerow(self, row : list):
+        '''Compares a row of the live walk with the verification file'''
+        path = row[PATH_COLUMN]
+        key = path_sort_key(path, self.baseline.root_folder, row[1] in (None, ""))
+        # every row of the verification file that comes before this one doesn't exist anymore
+        for deleted_row in self.baseline.seek(key):
+            self.deleted(deleted_row)
+        if self.baseline.current_key != key:
+            self.added(path, row)
+            return
+        old_row = self.baseline.current
+        self.baseline.advance()
+        self.compare(old_row, row)
+
+    def compare(self, old_row : list, row : list):
+        '''Compares the row of a path in the verification file with the live row of the same path
+        (or with the row of the same path in another verification file, see compare_trees)'''
+        changes = []
+        for column, field in self.FIELDS:
+            if column in self.ID_COLUMNS:
+                id_column, resolve = self.ID_COLUMNS[column]
+                old_id = optional_int(old_row, id_column)
+                new_id = optional_int(row, id_column)
+                if old_id is not None and old_id == new_id:
+                    continue
+                # changed id, or a verification file without ids (compared by name)
+                new_value = row[column] if row[column] not in (None, "") else resolve(new_id)
+            else:
+                new_value = "" if row[column] is None else str(row[column])
+            if old_row[column] != new_value:
+                changes.append((field, old_row[column], new_value))
+        if changes: # If something has changed, print it
+            self.modified(row[PATH_COLUMN], changes, self.changed_ranges(old_row, row))
+        else:
+            self.unchanged(row[PATH_COLUMN])
+
+    def changed_ranges(self, old_row : list, row : list):
+        '''Returns the [start, end) byte ranges of the blocks that differ between two rows of a file hashed in blocks,
+        or None if they can't be told (the file isn't hashed in blocks in one of them)'''
+        old_blocks = old_row[BLOCKS_COLUMN] if len(old_row) > BLOCKS_COLUMN else None
+        new_blocks = row[BLOCKS_COLUMN] if len(row) > BLOCKS_COLUMN else None
+        if self.block_size is None or not old_blocks or not new_blocks or old_row[6] == row[6]:
+            return None
+        old_blocks, new_blocks = old_blocks.split(), new_blocks.split()
+        end_of_file = max(int(old_row[1]), int(row[1]))
+        ranges = []
+        for index in range(max(len(old_blocks), len(new_blocks))):
+            if index < len(old_blocks) and index < len(new_blocks) and old_blocks[index] == new_blocks[index]:
+                continue
+            start, end = index * self.block_size, min((index + 1) * self.block_size, end_of_file)
+            if ranges and ranges[-1][1] == start: # adjacent to the previous range
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def modified(self, path : str, changes : list, changed_ranges : list = None):
+        self.num_modified += 1
+        if self.verbose:
+            print(f"Warning: the file/folder {path} has undergone the following modifications:")
+            for field, old_value, new_value in changes:
+                print(f"\t{field}:\t|{old_value}| --> |{new_value}|")
+            if changed_ranges is not None:
+                print("\tChanged byte ranges:\t" + ", ".join(f"[{start}, {end})" for start, end in changed_ranges))
+        if self.report is not None:
+            self.report.modified(path, changes, changed_ranges)
+        self.check_limit()
+
+    def added(self, path : str, row : list = None):
+        '''row is the live row of the path, if it is known (only needed by the ChangeReport)'''
+        self.num_added += 1
+        if self.verbose:
+            print(f"Warning: the file/folder {path} has been added!")
+        if self.report is not None:
+            self.report.added(path, row)
+        self.check_limit()
+
+    def deleted(self, row : list):
+        self.num_deleted += 1
+        if self.verbose:
+            print(f"Warning: the file/folder {row[PATH_COLUMN]} has been deleted!")
+        if self.report is not None:
+            self.report.deleted(row)
+        self.check_limit()
+
+    def check_limit(self):
+        if self.max_warnings is not None and self.num_warnings >= self.max_warnings:
+            raise WarningLimitReached(f"The limit of {self.max_warnings} warnings has been reached")
+
+    def unchanged(self, path : str):
+        '''Called for every path that is identical to the verification file (nothing to report)'''
+
+    def close(self):
+        '''Reports every row left in the verification file as deleted'''
+        while self.baseline.current is not None:
+            self.deleted(self.baseline.current)
+            self.baseline.advance()
+
+    @property
+    def num_warnings(self) -> int:
+        return self.num_deleted + self.num_added + self.num_modified
+
+class WarningLimitReached(Exception):
+    '''Raised by VerificationComparator when max_warnings warnings have been issued, to stop the run early'''
+
+class ChangeReport:
+    '''Machine-readable report of the changes found by a VerificationComparator, in JSON Lines format (one JSON
+    object per line). Every line is written and flushed as soon as the change is found, so the report can be
+    followed while the run goes on and nothing accumulates in memory.
+    The first line is {"event": "start", "schema": 1, ...} with the settings of the run and the last one is
+    {"event": "end", "deleted": n, "added": n, "modified": n, "stopped_early": bool}. Every change in between is
+    {"event": "deleted" | "added" | "modified", "path": path, "before": fields, "after": fields}, where fields maps
+    size (integer), owner, group, permissions, mtime and hash to their values (null if missing, e.g. the size and
+    mtime of directories). before is null for added paths and after is null for deleted paths; for modified paths
+    both only hold the fields that have changed, and changed_ranges lists the [start, end) byte ranges that differ
+    in a file hashed in blocks (null if the file isn't hashed in blocks)'''
+
+    SCHEMA = 1
+    # (column, key) of the fields of a row, in the order of VerificationComparator.FIELDS
+    KEYS = [(1, "size"), (2, "owner"), (3, "group"), (4, "permissions"), (5, "mtime"), (6, "hash")]
+    FIELD_KEYS = {field: key for (_, field), (_, key) in zip(VerificationComparator.FIELDS, KEYS)}
+
+    def __init__(self, path : str, **settings):
+        self.file = open(path, "w", buffering=1) # line buffered
+        self.write({"event": "start", "schema": self.SCHEMA, **settings})
+
+    def write(self, record : dict):
+        self.file.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def value(key : str, value):
+        if value in (None, ""):
+            return None
+        return int(value) if key == "size" else str(value)
+
+    @classmethod
+    def fields(cls, row : list) -> dict:
+        '''Returns the fields of a row (a live row may only have the numeric owner and group ids)'''
+        fields = {}
+        for column, key in cls.KEYS:
+            value = row[column]
+            if value in (None, "") and column in VerificationComparator.ID_COLUMNS:
+                id_column, resolve = VerificationComparator.ID_COLUMNS[column]
+                number = optional_int(row, id_column)
+                value = None if number is None else resolve(number)
+            fields[key] = cls.value(key, value)
+        return fields
+
+    def modified(self, path : str, changes : list, changed_ranges : list = None):
+        before = {self.FIELD_KEYS[field]: self.value(self.FIELD_KEYS[field], old) for field, old, _ in changes}
+        after = {self.FIELD_KEYS[field]: self.value(self.FIELD_KEYS[field], new) for field, _, new in changes}
+        self.write({"event": "modified", "path": path, "before": before, "after": after, "changed_ranges": changed_ranges})
+
+    def added(self, path : str, row : list = None):
+        self.write({"event": "added", "path": path, "before": None, "after": None if row is None else self.fields(row)})
+
+    def deleted(self, row : list):
+        self.write({"event": "deleted", "path": row[PATH_COLUMN], "before": self.fields(row), "after": None})
+
+    def end(self, comparator : VerificationComparator, stopped_early : bool = False):
+        '''Writes the last line (a report without it belongs to a run that has failed)'''
+        self.write({"event": "end", "deleted": comparator.num_deleted, "added": comparator.num_added,
+                    "modified": comparator.num_modified, "stopped_early": stopped_early})
+
+    def close(self):
+        self.file.close()
 
 def check_if_file_is_inside_folder(filePath : str, dirPath : str) -> bool:
     '''Takes the path to a file and the path to a directory and returns True if the file
@@ -18,98 +692,1915 @@ def check_if_file_is_inside_folder(filePath : str, dirPath : str) -> bool:
     else:
         return False
 
-def calculate_hash(filepath : str, hasher : hashlib._hashlib.HASH) -> str:
-    '''Takes the path to a file and the hashing function in input and returns the hashed digest of said file'''
-    with open(filepath, "rb") as f:
+class Metrics:
+    '''Instrumentation of a run: time spent per phase (with time.perf_counter_ns), counters of files,
+    directories and bytes hashed, and the slowest files to hash. When metrics are disabled the scan is
+    given None instead of a Metrics object, so the only cost left is an "is not None" check'''
+
+    # phases, in the order in which they are reported
+    PHASES = ["walk", "nss", "fingerprints", "hash", "hash wait", "write", "compare"]
+
+    def __init__(self, slowest : int = 10):
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.phases = collections.Counter() # ns spent in every phase
+        self.counts = collections.Counter()
+        self.num_slowest = slowest
+        self.slowest = [] # min-heap of (ns, path) of the slowest files to hash
+
+    def add(self, phase : str, elapsed_ns : int):
+        self.phases[phase] += elapsed_ns
+
+    def file_hashed(self, path : str, size : int, elapsed_ns : int):
+        '''Records a file that has been hashed in elapsed_ns (by the calling thread or by a worker)'''
+        self.phases["hash"] += elapsed_ns
+        self.counts["files hashed"] += 1
+        self.counts["bytes hashed"] += size
+        if len(self.slowest) < self.num_slowest:
+            heapq.heappush(self.slowest, (elapsed_ns, path))
+        elif self.slowest and elapsed_ns > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (elapsed_ns, path))
+
+    def stop(self):
+        self.end_ns = time.perf_counter_ns()
+
+    def to_dict(self) -> dict:
+        '''Returns the metrics as a dictionary (the content of the JSON sidecar file)'''
+        total_s = ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e9
+        hash_s = self.phases["hash"] / 1e9
+        return {
+            "total_time_s": total_s,
+            "phases_s": {phase: self.phases[phase] / 1e9 for phase in self.PHASES if phase in self.phases},
+            "counts": dict(self.counts),
+            "throughput": {
+                "entries_per_s": (self.counts["files"] + self.counts["dirs"]) / total_s if total_s else None,
+                # time spent hashing, summed over all the workers
+                "hash_mb_per_s": self.counts["bytes hashed"] / 1e6 / hash_s if hash_s else None,
+                # bytes hashed over the whole run
+                "overall_mb_per_s": self.counts["bytes hashed"] / 1e6 / total_s if total_s else None,
+            },
+            "slowest_files": [{"path": path, "time_s": ns / 1e9} for ns, path in sorted(self.slowest, reverse=True)],
+        }
+
+    def report_lines(self) -> list:
+        '''Returns the metrics formatted as lines of the report file'''
+        metrics = self.to_dict()
+        lines = ["------------ Metrics ------------",
+                 f"Total time: {metrics['total_time_s']:.6f} (seconds)"]
+        for phase, seconds in metrics["phases_s"].items():
+            lines.append(f"Time spent in {phase}: {seconds:.6f} (seconds)")
+        for name, count in metrics["counts"].items():
+            lines.append(f"Number of {name}: {count}")
+        for name, value in metrics["throughput"].items():
+            if value is not None:
+                lines.append(f"Throughput ({name.replace('_', ' ')}): {value:.1f}")
+        for index, slow in enumerate(metrics["slowest_files"]):
+            lines.append(f"Slowest file {index+1}: {slow['path']} ({slow['time_s']:.6f} seconds)")
+        return lines
+
+def save_metrics(metrics : Metrics, report_file, add_to_report : bool, json_path : str):
+    '''Stops the metrics and writes them to the (open) report file if add_to_report is True, and to json_path if given'''
+    metrics.stop()
+    if add_to_report:
+        for line in metrics.report_lines():
+            report_file.write(line + "\n")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(metrics.to_dict(), f, indent=2)
+
+# Supported hash functions; the constructor is looked up once per scan (or batch), not once per file
+HASH_FUNCTIONS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
+# Default number of bytes read (and hashed) at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Every thread reuses its own read buffer, so no bytes object is allocated per chunk
+_buffers = threading.local()
+
+def read_buffer(chunk_size : int) -> memoryview:
+    '''Returns a writable memoryview of chunk_size bytes that belongs to the calling thread'''
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = memoryview(bytearray(chunk_size))
+        _buffers.buffer = buffer
+    return buffer
+
+def calculate_hash(filepath : str, hasher : hashlib._hashlib.HASH, chunk_size : int = DEFAULT_CHUNK_SIZE) -> str:
+    '''Takes the path to a file and the hashing function in input and returns the hashed digest of said file.
+    The file is read chunk_size bytes at a time into a reusable buffer, so the data is never copied into new
+    bytes objects. It is never mapped in memory: a mapped file that is truncated while it is hashed (a rotated
+    log, a live database) would kill the whole process with SIGBUS'''
+    with open(filepath, "rb", buffering=0) as f:
+        buffer = read_buffer(chunk_size)
         while True:
-            data = f.read(4096)
-            if not data:
+            n = f.readinto(buffer)
+            if not n:
                 break
-            hasher.update(data)
+            hasher.update(buffer[:n])
     return hasher.hexdigest()
 
-def scan_folder(root_folder : str, csv_writer : csv.writer):
-    '''Method that recursively scans the parsed root folder and everyone of its subfolder, up to any depth.
-    The csv.writer argument is used for writing all the necessary informations to a csv file.
-    It returns the number of files and folder (in this order) that have been scanned'''
+def calculate_block_hashes(filepath : str, constructor, block_size : int, chunk_size : int = DEFAULT_CHUNK_SIZE,
+                           jobs : int = 1, known_blocks : list = ()) -> list:
+    '''Returns the digests of the block_size blocks of a file (the last one can be shorter). The blocks are read
+    with pread, chunk_size bytes at a time, and hashed by jobs threads at once, so a single large file keeps
+    several cores busy. The digests of the first blocks can be given in known_blocks, then only the blocks
+    after them are read (a file that has only been appended to, see scan_folder)'''
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        num_blocks = max(1, -(-size // block_size))
+        known_blocks = list(known_blocks[:num_blocks])
+
+        def hash_block(index : int) -> str:
+            hasher = constructor()
+            buffer = read_buffer(chunk_size)
+            offset = index * block_size
+            end = min(offset + block_size, size)
+            while offset < end:
+                n = os.preadv(fd, [buffer[:min(chunk_size, end - offset)]], offset)
+                if not n: # the file has shrunk in the meanwhile
+                    break
+                hasher.update(buffer[:n])
+                offset += n
+            return hasher.hexdigest()
+
+        indexes = range(len(known_blocks), num_blocks)
+        if jobs > 1 and len(indexes) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(jobs, len(indexes))) as pool:
+                return known_blocks + list(pool.map(hash_block, indexes))
+        return known_blocks + [hash_block(index) for index in indexes]
+    finally:
+        os.close(fd)
+
+def hash_file(filepath : str, constructor, chunk_size : int = DEFAULT_CHUNK_SIZE, size : int = None,
+              block_size : int = None, jobs : int = 1, known_blocks : list = ()):
+    '''Returns the digest of a file (see calculate_hash). Files larger than block_size, if given, are hashed in
+    blocks instead (see calculate_block_hashes) and a (digest, block digests) tuple is returned: the digest is
+    the digest of the concatenated block digests and the block digests are separated by spaces (see BLOCKS_COLUMN)'''
+    if block_size is None or size is None or size <= block_size:
+        return calculate_hash(filepath, constructor(), chunk_size)
+    blocks = calculate_block_hashes(filepath, constructor, block_size, chunk_size, jobs, known_blocks)
+    return constructor(bytes.fromhex("".join(blocks))).hexdigest(), " ".join(blocks)
+
+def store_digest(row : list, digest):
+    '''Stores what hash_file returned in a row of the walk'''
+    if isinstance(digest, tuple):
+        row[6], row[BLOCKS_COLUMN] = digest
+    else:
+        row[6] = digest
+
+def hash_files(files : list, hash_name : str, chunk_size : int = DEFAULT_CHUNK_SIZE, timed : bool = False,
+               block_size : int = None, jobs : int = 1) -> list:
+    '''Takes a list of (path, size, known blocks) tuples and the name of a hash function and returns the list of
+    their digests, see hash_file (or of (digest, nanoseconds spent) tuples, if timed is True).
+    It is a module level function so that it can also be sent to a pool of processes'''
+    constructor = HASH_FUNCTIONS[hash_name]
+    if not timed:
+        return [hash_file(path, constructor, chunk_size, size, block_size, jobs, known) for path, size, known in files]
+    digests = []
+    for path, size, known in files:
+        start = time.perf_counter_ns()
+        digest = hash_file(path, constructor, chunk_size, size, block_size, jobs, known)
+        digests.append((digest, time.perf_counter_ns() - start))
+    return digests
+
+class HashingQueue:
+    '''Bounded queue of rows waiting to be written to the verification file.
+    Files are hashed by a pool of workers (threads or processes), in batches of batch_size paths, while the
+    rows are still written in the order in which they were put in the queue. At most max_pending rows are
+    kept in memory: when the queue is full the oldest row is written, waiting for its digest if needed.
+    Without an executor every digest is computed right away in the calling thread.
+    A row can also take its digest from a row put before it (another hard link to the same file).
+    Files larger than block_size, if given, are hashed in blocks by block_jobs threads (see hash_file)'''
+
+    def __init__(self, csv_writer : csv.writer, hash_name : str, executor : concurrent.futures.Executor = None,
+                 batch_size : int = 1, max_pending : int = 64, chunk_size : int = DEFAULT_CHUNK_SIZE,
+                 metrics : Metrics = None, write_phase : str = "write", block_size : int = None, block_jobs : int = 1):
+        self.csv_writer = csv_writer
+        self.metrics = metrics
+        self.write_phase = write_phase # metrics phase of csv_writer.writerow
+        self.hash_name = hash_name
+        self.constructor = HASH_FUNCTIONS[hash_name]
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.block_jobs = block_jobs
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.pending = collections.deque() # (row, batch, index in the batch, row the digest is copied from)
+        self.batch = None                   # [future, (path, size, known blocks) list] of the batch that is being filled
+
+    def put(self, row : list, path : str = None, source : list = None, known_blocks : list = ()):
+        '''Adds a row to the queue. If path is given, the digest of that file is stored in the hash column of the row
+        (known_blocks are passed to hash_file); if source is given, the digest of that row (which must have been
+        put before) is copied instead'''
+        if self.executor is None:
+            if source is not None:
+                row[6], row[BLOCKS_COLUMN] = source[6], source[BLOCKS_COLUMN]
+            if self.metrics is not None:
+                self.put_timed(row, path, known_blocks)
+                return
+            if path is not None:
+                store_digest(row, hash_file(path, self.constructor, self.chunk_size, row[1], self.block_size,
+                                            self.block_jobs, known_blocks))
+            self.csv_writer.writerow(row)
+            return
+        if path is None:
+            self.pending.append((row, None, None, source))
+        else:
+            if self.batch is None:
+                self.batch = [None, []]
+            self.pending.append((row, self.batch, len(self.batch[1]), None))
+            self.batch[1].append((path, row[1], known_blocks))
+            if len(self.batch[1]) >= self.batch_size:
+                self.submit()
+        while len(self.pending) > self.max_pending:
+            self.write_oldest()
+
+    def put_timed(self, row : list, path : str, known_blocks : list = ()):
+        '''Same as put without an executor, but recording the time spent hashing and writing'''
+        if path is not None:
+            start = time.perf_counter_ns()
+            store_digest(row, hash_file(path, self.constructor, self.chunk_size, row[1], self.block_size,
+                                        self.block_jobs, known_blocks))
+            self.metrics.file_hashed(path, row[1], time.perf_counter_ns() - start)
+        start = time.perf_counter_ns()
+        self.csv_writer.writerow(row)
+        self.metrics.add(self.write_phase, time.perf_counter_ns() - start)
+
+    def submit(self):
+        '''Sends the batch that is being filled to the pool of workers'''
+        if self.batch is not None:
+            self.batch[0] = self.executor.submit(hash_files, self.batch[1], self.hash_name, self.chunk_size,
+                                                 self.metrics is not None, self.block_size, self.block_jobs)
+            self.batch = None
+
+    def write_oldest(self):
+        '''Writes the oldest row of the queue, waiting for its digest if needed'''
+        row, batch, index, source = self.pending.popleft()
+        if source is not None: # the source row is older, so it has already been written
+            row[6], row[BLOCKS_COLUMN] = source[6], source[BLOCKS_COLUMN]
+        if self.metrics is not None:
+            self.write_oldest_timed(row, batch, index)
+            return
+        if batch is not None:
+            if batch[0] is None: # the row belongs to the batch that is still being filled
+                self.submit()
+            store_digest(row, batch[0].result()[index])
+        self.csv_writer.writerow(row)
+
+    def write_oldest_timed(self, row : list, batch : list, index : int):
+        '''Same as write_oldest, but recording the time spent waiting for the workers and writing.
+        The hashing time of every file is measured by the worker that hashed it'''
+        if batch is not None:
+            if batch[0] is None:
+                self.submit()
+            start = time.perf_counter_ns()
+            digest, elapsed_ns = batch[0].result()[index]
+            store_digest(row, digest)
+            self.metrics.add("hash wait", time.perf_counter_ns() - start)
+            self.metrics.file_hashed(row[PATH_COLUMN], row[1], elapsed_ns)
+        start = time.perf_counter_ns()
+        self.csv_writer.writerow(row)
+        self.metrics.add(self.write_phase, time.perf_counter_ns() - start)
+
+    def flush(self):
+        '''Writes all the rows that are still in the queue'''
+        while self.pending:
+            self.write_oldest()
+
+def make_executor(jobs : int, use_processes : bool = False) -> concurrent.futures.Executor:
+    '''Returns a pool of jobs workers (processes if use_processes is True, threads otherwise),
+    or None if the files should be hashed one after another'''
+    if jobs <= 1:
+        return None
+    if use_processes:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+# Symbolic link policies of the walk: "follow" follows the links (a link to a directory is walked, unless its target
+# is inside the root folder, where it is walked anyway, or is one of its own ancestors, which would be a loop);
+# "record" never follows them and records every link as a file whose digest is the digest of its target path
+SYMLINK_POLICIES = ["follow", "record"]
+
+def entry_is_dir(entry : os.DirEntry, follow_symlinks : bool) -> bool:
+    '''DirEntry.is_dir, except that a link whose target can't be reached (a loop, no permission) is not a directory'''
+    try:
+        return entry.is_dir(follow_symlinks=follow_symlinks)
+    except OSError:
+        return False
+
+def list_directory(dir_path : str, follow_symlinks : bool = True) -> list:
+    '''Lists the content of dir_path with a single os.scandir call and returns its DirEntry objects,
+    sorted by name, with all the directories first followed by all the files.
+    DirEntry.is_dir() reuses the file type returned by the directory listing, so no extra syscall is
+    needed except for symbolic links (which are followed, like os.path.isdir does, if follow_symlinks is True)'''
+    dirList = []
+    filesList = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry_is_dir(entry, follow_symlinks):
+                dirList.append(entry)
+            else:
+                filesList.append(entry)
+    dirList.sort(key=lambda entry: entry.name)
+    filesList.sort(key=lambda entry: entry.name)
+    return dirList + filesList
+
+def stat_entry(path : str, follow_symlinks : bool) -> os.stat_result:
+    '''Returns the lstat of path or, if it is a symbolic link that must be followed, the stat of its target
+    (the lstat if the link is broken or its target can't be reached)'''
+    st = os.lstat(path)
+    if follow_symlinks and stat.S_ISLNK(st.st_mode):
+        try:
+            st = os.stat(path)
+        except OSError:
+            pass
+    return st
+
+def descend_into(path : str, st : os.stat_result, ancestors : tuple, real_root : str):
+    '''Decides if the walk goes into the directory path (whose stat_result, links followed, is st).
+    ancestors holds the (st_dev, st_ino) of the directories above it. It returns the ancestors of its
+    content, or None if the directory must not be walked: a link to a directory inside the root folder
+    (walked under its own path) or to one of its own ancestors (a loop)'''
+    key = (st.st_dev, st.st_ino)
+    if key in ancestors:
+        print(f"Symbolic link loop: {path} leads back to one of its parent directories and is not followed")
+        return None
+    if os.path.islink(path):
+        target = os.path.realpath(path)
+        if target == real_root or target.startswith(real_root + os.sep):
+            return None
+    return ancestors + (key,)
+
+class WalkFilter:
+    '''Rules that select the entries of the walk of root_folder. They are evaluated by walk_tree before an entry is
+    stat-ed, so an excluded directory is never listed:
+    - exclude/exclude_regex: entries (and whole subtrees) to leave out;
+    - include/include_regex: if any is given, only the files that match one of them are kept (directories are always
+      walked, since their content can match);
+    - one_file_system: the directories on another file system than root_folder (mount points) are recorded but
+      not walked;
+    - max_depth: entries deeper than max_depth levels below root_folder are left out (1 is only the content of root_folder);
+    - min_size/max_size: files smaller/larger than that (in bytes) are left out (this needs their stat).
+    Globs containing a "/" are matched against the path relative to root_folder, the others against the name of the
+    entry; regular expressions are searched in the relative path. The rules are written in the verification file
+    (see to_options), so that verification applies the same ones'''
+
+    # names of the rules, as they are written in the verification file
+    RULES = ["include", "exclude", "include_regex", "exclude_regex", "one_file_system", "max_depth", "min_size", "max_size"]
+
+    def __init__(self, root_folder : str, include : list = (), exclude : list = (), include_regex : list = (),
+                 exclude_regex : list = (), one_file_system : bool = False, max_depth : int = None,
+                 min_size : int = None, max_size : int = None):
+        self.root_folder = root_folder
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.include_regex = list(include_regex)
+        self.exclude_regex = list(exclude_regex)
+        self.one_file_system = one_file_system
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_size = max_size
+        self.compiled_include = [re.compile(pattern) for pattern in self.include_regex]
+        self.compiled_exclude = [re.compile(pattern) for pattern in self.exclude_regex]
+        self.root_dev = os.stat(root_folder).st_dev if one_file_system else None
+
+    @classmethod
+    def from_options(cls, root_folder : str, walk_options : dict):
+        '''Returns the filter described by walk options (see to_options), or None if they don't filter anything'''
+        rules = {rule: walk_options[rule] for rule in cls.RULES if walk_options.get(rule)}
+        return cls(root_folder, **rules) if rules else None
+
+    def to_options(self) -> dict:
+        return {rule: getattr(self, rule) for rule in self.RULES}
+
+    def relative(self, path : str) -> str:
+        return path[len(self.root_folder):].lstrip(os.sep)
+
+    @staticmethod
+    def matches(relative_path : str, globs : list, regexes : list) -> bool:
+        name = relative_path.rsplit(os.sep, 1)[-1]
+        for glob in globs:
+            if fnmatch.fnmatchcase(relative_path if "/" in glob else name, glob):
+                return True
+        return any(regex.search(relative_path) for regex in regexes)
+
+    def excludes(self, path : str, is_dir : bool) -> bool:
+        '''Returns True if the entry path is left out of the walk (without looking at its stat)'''
+        relative_path = self.relative(path)
+        if self.max_depth is not None and relative_path.count(os.sep) + 1 > self.max_depth:
+            return True
+        if self.matches(relative_path, self.exclude, self.compiled_exclude):
+            return True
+        if not is_dir and (self.include or self.include_regex):
+            return not self.matches(relative_path, self.include, self.compiled_include)
+        return False
+
+    def excludes_size(self, size : int) -> bool:
+        return (self.min_size is not None and size < self.min_size) or (self.max_size is not None and size > self.max_size)
+
+    def descends(self, path : str, st : os.stat_result) -> bool:
+        '''Returns False if the content of the directory path is left out of the walk'''
+        if self.one_file_system and st.st_dev != self.root_dev:
+            return False
+        return self.max_depth is None or self.relative(path).count(os.sep) + 1 < self.max_depth
+
+def baseline_walk(baseline, root_folder : str) -> tuple:
+    '''Returns the symbolic link policy and the WalkFilter (or None) that a verification file has been created with,
+    so that root_folder is walked in the same way (verification files without walk options used the defaults)'''
+    walk_options = baseline.read_walk_options() or {}
+    return walk_options.get("symlinks", "follow"), WalkFilter.from_options(root_folder, walk_options)
+
+def walk_tree(root_folder : str, stealer = None, symlinks : str = "follow", start : tuple = None, skip_until : tuple = None,
+              walk_filter : WalkFilter = None):
+    '''Generator that walks root_folder and every one of its subfolders, up to any depth, and yields a
+    (name, path, stat_result, is_dir) tuple for every entry.
+    Inside each directory the sorted subdirectories come first, each one immediately followed by its own
+    content, and the sorted files come last. An explicit stack of directory iterators is used instead of
+    recursion, so the depth of the tree is not bounded by the recursion limit.
+    Symbolic links are handled according to the symlinks policy (see SYMLINK_POLICIES); with any policy a
+    directory is never walked twice on the same branch, so the walk always ends.
+    If a WorkStealer is given, the subdirectories that haven't been visited yet at the shallowest level are
+    handed over to it when other walkers are idle (they are then walked by someone else). A walk can also
+    start from one of these, given as start: a (path, ancestors) tuple (see descend_into).
+    If skip_until (a path_sort_key) is given, the entries up to it are not yielded, and the directories that
+    come entirely before it are not even listed (used to resume an interrupted walk, see InitCheckpoint).
+    If a WalkFilter is given, the entries it excludes are skipped before they are stat-ed'''
+    follow_symlinks = symlinks == "follow"
+    real_root = os.path.realpath(root_folder)
+    if start is None:
+        st = os.stat(root_folder)
+        start = (root_folder, ((st.st_dev, st.st_ino),))
+    path, ancestors = start
+    # one (directory iterator, ancestors of its content) pair per level
+    stack = [(iter(list_directory(path, follow_symlinks)), ancestors)]
+    while stack:
+        if stealer is not None and stealer.wanted():
+            for level, (entries, level_ancestors) in enumerate(stack):
+                remaining = list(entries)
+                donated = [entry.path for entry in remaining if entry_is_dir(entry, follow_symlinks)]
+                if donated:
+                    remaining = [entry for entry in remaining if not entry_is_dir(entry, follow_symlinks)]
+                stack[level] = (iter(remaining), level_ancestors)
+                if donated:
+                    stealer.donate([(donated_path, level_ancestors) for donated_path in donated])
+                    break
+        entries, ancestors = stack[-1]
+        entry = next(entries, None)
+        if entry is None: # this directory has been fully visited, go back to its parent
+            stack.pop()
+            continue
+        skipped = False
+        if skip_until is not None:
+            key = path_sort_key(entry.path, root_folder, entry_is_dir(entry, follow_symlinks))
+            if key > skip_until:
+                skip_until = None # from here on, nothing has been walked yet
+            elif key[-1][0] == 0 and key == skip_until[:len(key)]:
+                skipped = True    # a directory that holds (or is) the last entry walked: only its content is left
+            else:
+                continue          # walked before, with all its content
+        if walk_filter is not None and walk_filter.excludes(entry.path, entry_is_dir(entry, follow_symlinks)):
+            continue # neither stat-ed nor, if it is a directory, listed
+        # one lstat per entry; symbolic links are followed with a second stat (as os.stat used to do) if the policy says so
+        st = entry.stat(follow_symlinks=False)
+        if follow_symlinks and stat.S_ISLNK(st.st_mode):
+            try:
+                st = entry.stat()
+            except OSError: # broken link, loop or unreachable target, recorded as a link
+                pass
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if walk_filter is not None and not is_dir and walk_filter.excludes_size(st.st_size):
+            continue
+        if not skipped:
+            yield entry.name, entry.path, st, is_dir
+        if is_dir and (walk_filter is None or walk_filter.descends(entry.path, st)):
+            # the content of a directory comes right after the directory itself
+            content_ancestors = descend_into(entry.path, st, ancestors, real_root)
+            if content_ancestors is not None:
+                stack.append((iter(list_directory(entry.path, follow_symlinks)), content_ancestors))
+
+def entry_row(name : str, path : str, st : os.stat_result, is_dir : bool, owner : str, group : str) -> list:
+    '''Returns the row of the verification file of an entry of the walk, without its digest (which is None)'''
+    # get the permissions
+    permissions = oct(st.st_mode & 0o777)
+    if is_dir:
+        #--------------writing phase for directories-----------------
+        size = None # The instructions say that only the size of files should be saved. This is for dirs.
+        # Assumption: the last modification datetime of a folder can be ambiguous (some might say it's the
+        # same of the last modified file, some might say it doesn't make sense). I decided to follow the latter.
+        formatted_datetime = None
+        inode = ctime_ns = mtime_ns = None
+    else:
+        #--------------writing phase for files-----------------
+        # get the size
+        size = st.st_size
+        # calculate last modification date
+        formatted_datetime = format_mtime(st.st_mtime_ns)
+        # fingerprint used by the fast verification to decide if the file has to be read again
+        inode, ctime_ns, mtime_ns = st.st_ino, st.st_ctime_ns, st.st_mtime_ns
+    # save all the values in a list before writing to the csv file
+    return [name, size, owner, group, permissions, formatted_datetime, None, path,
+            inode, ctime_ns, mtime_ns, st.st_uid, st.st_gid, None]
+
+# Number of files remembered by scan_folder when symbolic links are followed, so that a file reached through a link
+# (next to it, or through another link) is not read again. Only a link to a file seen long before is read twice
+MAX_RECENT_FILES = 16384
+
+def stat_fingerprint(st : os.stat_result) -> tuple:
+    '''Returns the fast verification fingerprint (size, inode, ctime_ns, mtime_ns) of a file, see row_fingerprint'''
+    return (st.st_size, st.st_ino, st.st_ctime_ns, st.st_mtime_ns)
+
+def scan_folder(root_folder : str, csv_writer : csv.writer, fingerprints = None,
+                jobs : int = 1, use_processes : bool = False, resolve_names : bool = True,
+                chunk_size : int = DEFAULT_CHUNK_SIZE, metrics : Metrics = None, walker = None, symlinks : str = "follow",
+                walk_filter : WalkFilter = None, hash_name : str = "sha1", executor : concurrent.futures.Executor = None,
+                block_size : int = None, trust_prefix : bool = False):
+    '''Walks root_folder (walk_tree with symlinks and walk_filter, or the given walker) and writes the row of every
+    entry to csv_writer (any object with a writerow method) in walk order. Files are hashed with hash_name by jobs
+    workers (or the given executor), every physical file only once. A file whose fingerprint is unchanged in
+    fingerprints (a lookup with get(path), see BaselineReader.get) keeps its digest; with trust_prefix a file that
+    has grown is only hashed from its last block on (see hash_file). Returns the number of files, folders and trusted files'''
+    settings = dict(resolve_names=resolve_names, chunk_size=chunk_size, metrics=metrics, walker=walker, symlinks=symlinks,
+                    walk_filter=walk_filter, hash_name=hash_name, block_size=block_size, trust_prefix=trust_prefix)
+    if executor is not None:
+        return scan_folder_with_executor(root_folder, csv_writer, fingerprints, executor, jobs, **settings)
+    executor = make_executor(jobs, use_processes)
+    try:
+        return scan_folder_with_executor(root_folder, csv_writer, fingerprints, executor, jobs, **settings)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def scan_folder_with_executor(root_folder : str, csv_writer : csv.writer, fingerprints,
+                              executor : concurrent.futures.Executor, jobs : int, *, resolve_names : bool, chunk_size : int,
+                              metrics : Metrics, walker, symlinks : str, walk_filter : WalkFilter, hash_name : str,
+                              block_size : int, trust_prefix : bool):
+    '''Body of scan_folder, which hashes the files with the given executor (None means in the calling thread)'''
     num_files = 0
     num_dirs = 0
-    # create a list of all the directories followed by all the files
-    dirList = [x for x in os.listdir(root_folder) if os.path.isdir(os.path.join(root_folder, x))]
-    filesList = [x for x in os.listdir(root_folder) if not os.path.isdir(os.path.join(root_folder, x))]
-    if dirList: # if this list is not empty, sort it
-        dirList.sort()
-    if filesList: # if this list is not empty, sort it
-        filesList.sort()
-    for filename in dirList + filesList:
-        path = os.path.join(root_folder, filename)
-        if os.path.isdir(path):
+    num_trusted = 0
+    # processes are fed with batches of paths, so that small files don't pay one round trip each
+    batch_size = 32 if isinstance(executor, concurrent.futures.ProcessPoolExecutor) else 1
+    write_phase = "compare" if isinstance(csv_writer, VerificationComparator) else "write"
+    queue = HashingQueue(csv_writer, hash_name, executor, batch_size, max_pending=4 * batch_size * jobs, chunk_size=chunk_size,
+                         metrics=metrics, write_phase=write_phase, block_size=block_size, block_jobs=jobs)
+    if walker is None:
+        walker = walk_tree(root_folder, symlinks=symlinks, walk_filter=walk_filter)
+    # (st_dev, st_ino) of the files with several hard links -> [row of the first link, links not seen yet]
+    hard_links = {}
+    # when links are followed, a file can also be reached through symbolic links, from anywhere in the tree:
+    # the last MAX_RECENT_FILES other files are remembered too ((st_dev, st_ino) -> [row], oldest first)
+    recent_files = collections.OrderedDict() if symlinks == "follow" else None
+    resolve_owner, resolve_group = owner_name, group_name
+    if metrics is not None: # the timers are only wrapped around the walk when metrics are enabled
+        walker = timed_walk(walker, metrics)
+        resolve_owner = TimedResolver(owner_name, metrics, "nss")
+        resolve_group = TimedResolver(group_name, metrics, "nss")
+        if fingerprints is not None:
+            fingerprints = TimedResolver(fingerprints.get, metrics, "fingerprints")
+    for name, path, st, is_dir in walker:
+        # get the owner and group names (each id is resolved once, see owner_name and group_name)
+        if resolve_names:
+            owner, group = resolve_owner(st.st_uid), resolve_group(st.st_gid)
+        else:
+            owner = group = None
+        toBeWritten = entry_row(name, path, st, is_dir, owner, group)
+        known_blocks = ()
+        if is_dir:
             num_dirs += 1
-            #--------------writing phase for directories-----------------
-            # Save only the name of the directory
-            name = filename
-            size = None # The instructions say that only the size of files should be saved. This is for dirs.
-            # get the owner name
-            dir_owner_uid = os.stat(path).st_uid
-            dir_owner_name = pwd.getpwuid(dir_owner_uid).pw_name
-            # get the group name
-            dir_group_uid = os.stat(path).st_gid
-            dir_group_name = grp.getgrgid(dir_group_uid).gr_name
-            # get the directory permissions
-            permissions = oct(os.stat(path).st_mode & 0o777)
-            # Assumption: the last modification datetime of a folder can be ambiguous (some might say it's the
-            # same of the last modified file, some might say it doesn't make sense). I decided to follow the latter.
-            date_time = None
-            # hash: None
-            hashed_value = None
-            # save all the values in a list before writing to the csv file
-            toBeWritten = [name, size, dir_owner_name, dir_group_name, permissions, date_time, hashed_value, path]
-            # writes to the csv
-            csv_writer.writerow(toBeWritten)
-            # next folder
-            sub_files, sub_dirs = scan_folder(path, csv_writer)
-            num_files += sub_files
-            num_dirs += sub_dirs
         else:
             num_files += 1
-            #--------------writing phase for files-----------------
-            # get the size
-            size = os.path.getsize(path)
-            # get the owner name
-            file_owner_uid = os.stat(path).st_uid
-            file_owner_name = pwd.getpwuid(file_owner_uid).pw_name
-            # get the group id
-            file_group_gid = os.stat(path).st_gid
-            file_group_name = grp.getgrgid(file_group_gid).gr_name
-            # permissions
-            permissions = oct(os.stat(path).st_mode & 0o777)
-            # calculate last modification date
-            modification_time_since_epoch = os.path.getmtime(path)
-            modification_datetime = datetime.datetime.fromtimestamp(modification_time_since_epoch)
-            formatted_datetime = modification_datetime.strftime("%d/%m/%Y %H:%M:%S GMT+1")
-            # calculate hash
-            if hashFun == "md5":
-                computed_message_digest = calculate_hash(path, hashlib.md5())
-            elif hashFun == "sha1":
-                computed_message_digest = calculate_hash(path, hashlib.sha1())
-            # save all the values in a list before writing to the csv file
-            toBeWritten = [filename, size, file_owner_name, file_group_name, permissions, formatted_datetime, computed_message_digest, path]
-            # writes to the csv
-            csv_writer.writerow(toBeWritten)
-    return num_files, num_dirs
-
-def copy_csv_and_remove_unwanted_lines(inputCsvFile : str, outputCsvFile : str, unwantedItems : set):
-    '''Opens the inputCsvFile and copies all the rows where the last column item doesn't belong\
-        to the set of unwantedItems into the the outputCsvFile.
-        Returns a FileIOWrapper of a csv file.
-    '''
-    with open(inputCsvFile, 'r') as inputCsv, open(outputCsvFile, "w", newline="") as outputCsv:
-        reader = csv.reader(inputCsv)
-        writer = csv.writer(outputCsv)
-        for row in reader:
-            if row[-1] not in unwantedItems:
-                writer.writerow(row)
-    return outputCsv
+            trusted = None
+            if fingerprints is not None:
+                trusted = fingerprints.get(path)
+            if trusted is not None and trusted[0] == stat_fingerprint(st):
+                # unchanged since the baseline, the old digest can be trusted
+                num_trusted += 1
+                if metrics is not None:
+                    metrics.counts["files trusted"] += 1
+                toBeWritten[6] = trusted[1]
+                toBeWritten[BLOCKS_COLUMN] = trusted[2] or None
+            elif (trust_prefix and block_size is not None and trusted is not None and trusted[2]
+                  and trusted[0][1] == st.st_ino and st.st_size > trusted[0][0]):
+                # the same file, grown: the full blocks it had are trusted, from its last (partial) block on it is hashed
+                known_blocks = trusted[2].split()[:trusted[0][0] // block_size]
+                if metrics is not None:
+                    metrics.counts["files appended"] += 1
+            elif stat.S_ISLNK(st.st_mode):
+                # a link that isn't followed (or is broken): its digest is the digest of its target path
+                toBeWritten[6] = HASH_FUNCTIONS[hash_name](os.fsencode(os.readlink(path))).hexdigest()
+        # writes to the csv (through the queue, which fills in the digest if it is still missing)
+        if is_dir or toBeWritten[6] is not None:
+            queue.put(toBeWritten)
+        elif st.st_nlink > 1 or recent_files is not None:
+            # a physical file is hashed once, the other paths to it take the digest of the first one
+            key = (st.st_dev, st.st_ino)
+            first_link = hard_links.get(key)
+            if first_link is None and recent_files is not None:
+                first_link = recent_files.get(key)
+            if first_link is None:
+                if st.st_nlink > 1:
+                    hard_links[key] = [toBeWritten, st.st_nlink - 1]
+                else:
+                    remember_file(recent_files, key, [toBeWritten])
+                queue.put(toBeWritten, path, known_blocks=known_blocks)
+            else:
+                queue.put(toBeWritten, source=first_link[0])
+                if len(first_link) == 1: # reached through a symbolic link
+                    recent_files.move_to_end(key)
+                else:
+                    first_link[1] -= 1
+                    if first_link[1] == 0: # every hard link has been seen, only symbolic links can still reach it
+                        del hard_links[key]
+                        if recent_files is not None:
+                            remember_file(recent_files, key, first_link[:1])
+                if metrics is not None:
+                    metrics.counts["files deduplicated"] += 1
+        else:
+            queue.put(toBeWritten, path, known_blocks=known_blocks)
+    queue.flush()
+    return num_files, num_dirs, num_trusted
+
+def remember_file(recent_files : collections.OrderedDict, key : tuple, entry : list):
+    '''Adds a file to the recently seen files of scan_folder, forgetting the oldest one if there are too many'''
+    recent_files[key] = entry
+    if len(recent_files) > MAX_RECENT_FILES:
+        recent_files.popitem(last=False)
+
+def timed_walk(walker, metrics : Metrics):
+    '''Wraps a walk_tree generator, adding the time spent listing and stat-ing to the "walk" phase'''
+    while True:
+        start = time.perf_counter_ns()
+        item = next(walker, None)
+        metrics.add("walk", time.perf_counter_ns() - start)
+        if item is None:
+            return
+        metrics.counts["dirs" if item[3] else "files"] += 1
+        yield item
+
+class TimedResolver:
+    '''Wraps owner_name/group_name/fingerprints.get, adding the time spent in them to a phase of the metrics'''
+
+    def __init__(self, function, metrics : Metrics, phase : str):
+        self.function = function
+        self.metrics = metrics
+        self.phase = phase
+
+    def __call__(self, key):
+        start = time.perf_counter_ns()
+        try:
+            return self.function(key)
+        finally:
+            self.metrics.add(self.phase, time.perf_counter_ns() - start)
+
+    get = __call__
+
+#------------ Sharded scan (several walker processes) ------------
+
+# Largest number of partial files merged at once (more are merged in several passes, to stay below the open files limit)
+MAX_MERGE_FILES = 256
+# Seconds between checks that no walker process has died while waiting for their results
+WALKER_POLL_INTERVAL = 0.1
+
+class WorkStealer:
+    '''Work stealing between the walker processes of scan_folder_sharded. A walker asks wanted() every check_every
+    entries: when some walker is idle and there is no task waiting, the walker donates the directories it hasn't
+    visited yet (see walk_tree), which become new tasks'''
+
+    def __init__(self, tasks : multiprocessing.Queue, pending : multiprocessing.Value, idle : multiprocessing.Value,
+                 check_every : int = 64):
+        self.tasks = tasks
+        self.pending = pending # tasks that have been queued and are not finished yet
+        self.idle = idle       # walkers waiting for a task
+        self.check_every = check_every
+        self.count = 0
+
+    def wanted(self) -> bool:
+        self.count += 1
+        if self.count % self.check_every:
+            return False
+        return self.idle.value > 0 and self.tasks.empty()
+
+    def donate(self, tasks : list):
+        '''Queues (path, ancestors) tasks, see task_walk'''
+        for task in tasks:
+            with self.pending.get_lock():
+                self.pending.value += 1
+            self.tasks.put(task)
+
+def task_walk(task : tuple, root_folder : str, stealer : WorkStealer, symlinks : str, walk_filter : WalkFilter = None):
+    '''Walk of a task of scan_folder_sharded, a (path, ancestors) tuple: a directory (whose own entry comes first,
+    unless it is the root folder) and all its content, in the same order as walk_tree'''
+    path, ancestors = task
+    if path == root_folder:
+        yield from walk_tree(root_folder, stealer, symlinks, walk_filter=walk_filter)
+        return
+    if walk_filter is not None and walk_filter.excludes(path, True): # donated before the filter was applied
+        return
+    st = stat_entry(path, symlinks == "follow")
+    yield os.path.basename(path), path, st, True
+    if walk_filter is not None and not walk_filter.descends(path, st):
+        return
+    content_ancestors = descend_into(path, st, ancestors, os.path.realpath(root_folder))
+    if content_ancestors is not None:
+        yield from walk_tree(root_folder, stealer, symlinks, start=(path, content_ancestors), walk_filter=walk_filter)
+
+def walker_process(walker_id : int, root_folder : str, hash_name : str, baseline, jobs : int, resolve_names : bool,
+                   chunk_size : int, symlinks : str, walk_filter : WalkFilter, partial_dir : str, tasks : multiprocessing.Queue, pending : multiprocessing.Value,
+                   idle : multiprocessing.Value, results : multiprocessing.Queue, abort : multiprocessing.Event,
+                   block_size : int = None, trust_prefix : bool = False):
+    '''Body of a walker process: takes tasks until every task is finished and writes the rows of each one,
+    sorted in walk order, to a partial CSV file. The list of partial files and the counters (or the traceback
+    of the error that stopped the walker) are put in results. A walker that fails sets abort, so that the other
+    ones stop taking tasks'''
+    partials = []
+    counts = [0, 0, 0]
+    try:
+        fingerprints = None if baseline is None else baseline.fingerprints(root_folder)
+        stealer = WorkStealer(tasks, pending, idle)
+        while True:
+            try:
+                task = tasks.get(timeout=0.05)
+            except queue.Empty:
+                if pending.value == 0 or abort.is_set():
+                    break
+                continue
+            if abort.is_set(): # another walker has failed, the scan is going to be stopped anyway
+                break
+            with idle.get_lock():
+                idle.value -= 1
+            try:
+                partial_path = os.path.join(partial_dir, f"{walker_id}-{len(partials)}.csv")
+                with open(partial_path, "w", newline="") as f:
+                    task_counts = scan_folder(root_folder, csv.writer(f), fingerprints, jobs, resolve_names=resolve_names,
+                                              chunk_size=chunk_size, walker=task_walk(task, root_folder, stealer, symlinks, walk_filter),
+                                              hash_name=hash_name, block_size=block_size, trust_prefix=trust_prefix)
+                partials.append(partial_path)
+                counts = [total + count for total, count in zip(counts, task_counts)]
+            finally: # the task is over even if it failed, so that the other walkers don't wait for it forever
+                with idle.get_lock():
+                    idle.value += 1
+                with pending.get_lock():
+                    pending.value -= 1
+        if fingerprints is not None:
+            fingerprints.close()
+        results.put((partials, counts, None))
+    except BaseException:
+        abort.set()
+        results.put((partials, counts, traceback.format_exc()))
+
+def merge_partials(paths : list, root_folder : str, csv_writer : csv.writer):
+    '''k-way merge of partial files, each one sorted in walk order, into csv_writer (in walk order)'''
+    files = [open(path, "r", newline="") for path in paths]
+    try:
+        key = lambda row: path_sort_key(row[PATH_COLUMN], root_folder, row_is_dir(row))
+        for row in heapq.merge(*[csv.reader(f) for f in files], key=key):
+            csv_writer.writerow(row)
+    finally:
+        for f in files:
+            f.close()
+
+def scan_folder_sharded(root_folder : str, csv_writer : csv.writer, walkers : int, baseline = None, jobs : int = 1,
+                        resolve_names : bool = True, chunk_size : int = DEFAULT_CHUNK_SIZE, symlinks : str = "follow",
+                        walk_filter : WalkFilter = None, hash_name : str = "sha1", block_size : int = None,
+                        trust_prefix : bool = False):
+    '''Same as scan_folder, but the tree is walked and hashed by walkers processes. The root folder is the first task;
+    every walker writes the rows of its tasks to sorted partial files and gives away unvisited subdirectories
+    whenever another walker is idle, so a subdirectory holding most of the files is shared too. The partial
+    files are then merged, so csv_writer receives the same rows, in the same order, as with scan_folder (as
+    strings, like the rows read back from a verification file).
+    If a verification file is given, its fingerprints are used like in scan_folder (every walker looks up its
+    own files, so it must be a format that can be searched, such as SQLite). Every walker hashes with jobs threads.
+    It returns the number of files, folders and trusted files (in this order) that have been scanned'''
+    tasks = multiprocessing.Queue()
+    pending = multiprocessing.Value("i", 1)
+    idle = multiprocessing.Value("i", walkers)
+    results = multiprocessing.Queue()
+    abort = multiprocessing.Event()
+    tasks.put((root_folder, ()))
+    with tempfile.TemporaryDirectory(prefix="siv-partials-") as partial_dir:
+        processes = [multiprocessing.Process(target=walker_process,
+                                             args=(i, root_folder, hash_name, baseline, jobs, resolve_names, chunk_size,
+                                                   symlinks, walk_filter, partial_dir, tasks, pending, idle, results,
+                                                   abort, block_size, trust_prefix))
+                     for i in range(walkers)]
+        for process in processes:
+            process.start()
+        outputs = []
+        error = None
+        try:
+            while len(outputs) < walkers and error is None:
+                try:
+                    output = results.get(timeout=WALKER_POLL_INTERVAL)
+                except queue.Empty:
+                    # a walker that is killed (or dies in the interpreter) never puts its output
+                    exitcodes = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+                    if exitcodes:
+                        error = f"A walker process has exited with code {exitcodes[0]}\n"
+                    continue
+                outputs.append(output)
+                error = output[2]
+        finally:
+            if error is not None or len(outputs) < walkers: # don't wait for the other walkers
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+            for process in processes:
+                process.join()
+        if error is not None:
+            raise Exception("A walker process has failed:\n" + error)
+        partials = [path for paths, _, _ in outputs for path in paths]
+        # merge in several passes if there are too many partial files to open at once
+        while len(partials) > MAX_MERGE_FILES:
+            merged_path = os.path.join(partial_dir, f"merged-{len(partials)}.csv")
+            with open(merged_path, "w", newline="") as f:
+                merge_partials(partials[:MAX_MERGE_FILES], root_folder, csv.writer(f))
+            partials = partials[MAX_MERGE_FILES:] + [merged_path]
+        merge_partials(partials, root_folder, csv_writer)
+    return tuple(sum(counts[i] for _, counts, _ in outputs) for i in range(3))
+
+#------------ Directory digests (Merkle tree) ------------
+
+def merkle_record(row : list, digest : str) -> bytes:
+    '''Returns what an entry contributes to the digest of its parent directory: its name, kind, size, owner and
+    group ids (names for verification files without ids), permissions, modification time in nanoseconds (the
+    local date for verification files without it, so that the record doesn't depend on the timezone) and digest
+    (the directory digest for directories). Rows of the live walk and rows read back from a verification file
+    give the same record'''
+    is_dir = row[1] in (None, "")
+    uid, gid = optional_int(row, UID_COLUMN), optional_int(row, GID_COLUMN)
+    mtime_ns = optional_int(row, MTIME_COLUMN)
+    fields = [row[0],
+              "d" if is_dir else "f",
+              "" if is_dir else str(row[1]),
+              row[2] if uid is None else str(uid),
+              row[3] if gid is None else str(gid),
+              row[4],
+              (row[5] or "") if mtime_ns is None else str(mtime_ns),
+              digest or ""]
+    return ("\0".join(fields) + "\n").encode("utf-8", "surrogateescape")
+
+class MerkleBuilder:
+    '''Computes the digest of every directory from the records (see merkle_record) of its content, so that two
+    trees with the same directory digest are identical. It wraps the writer of a verification file: the rows of
+    the walk are received through writerow(), in walk order, and passed on, and the digest of a directory is
+    written with write_tree_digest() as soon as its last entry has been seen (post-order, the root comes last).
+    Only the directories that are still open are kept in memory'''
+
+    def __init__(self, csv_writer, root_folder : str, hash_name : str):
+        self.csv_writer = csv_writer
+        self.constructor = HASH_FUNCTIONS[hash_name]
+        # (path, hasher, row) of every open directory, from the root folder (which has no row) down
+        self.stack = [(root_folder, self.constructor(), None)]
+
+    def writerow(self, row : list):
+        self.close_directories(row[PATH_COLUMN])
+        self.csv_writer.writerow(row)
+        self.add(row)
+
+    def replay(self, row : list):
+        '''Same as writerow, for a row that has already been written by an interrupted run (see InitCheckpoint)'''
+        self.close_directories(row[PATH_COLUMN])
+        self.add(row)
+
+    def close_directories(self, path : str):
+        '''Closes every open directory that path is not inside of'''
+        while len(self.stack) > 1 and not path.startswith(self.stack[-1][0] + os.sep):
+            self.close_directory()
+
+    def add(self, row : list):
+        path = row[PATH_COLUMN]
+        if row[1] in (None, ""):
+            self.stack.append((path, self.constructor(), row))
+        else:
+            self.stack[-1][1].update(merkle_record(row, row[6]))
+
+    def close_directory(self):
+        path, hasher, row = self.stack.pop()
+        digest = hasher.hexdigest()
+        self.csv_writer.write_tree_digest(path, digest)
+        self.stack[-1][1].update(merkle_record(row, digest))
+
+    def close(self):
+        '''Writes the digests of the directories that are still open, the root folder last'''
+        while len(self.stack) > 1:
+            self.close_directory()
+        root_folder, hasher, _ = self.stack.pop()
+        self.csv_writer.write_tree_digest(root_folder, hasher.hexdigest())
+
+class CsvTreeIndex:
+    '''Content and directory digests of a CSV verification file, by path relative to its root folder.
+    A CSV file can't be searched, so it is loaded in memory'''
+
+    def __init__(self, baseline : CsvBaseline):
+        self.digests = dict(baseline.tree_digests())
+        # the root folder is the last directory digest
+        self.root_folder = next(reversed(self.digests), None)
+        self.content = collections.defaultdict(list)
+        if self.root_folder is not None:
+            for row in baseline.rows():
+                self.content[os.path.dirname(self.relative(row[PATH_COLUMN]))].append(row)
+
+    def relative(self, path : str) -> str:
+        return path[len(self.root_folder):].lstrip(os.sep)
+
+    def tree_digest(self, relative_path : str) -> str:
+        return self.digests.get(os.path.join(self.root_folder, relative_path) if relative_path else self.root_folder)
+
+    def children(self, relative_path : str) -> list:
+        '''Returns the rows of the content of a directory, in walk order'''
+        return self.content.get(relative_path, [])
+
+    def close(self):
+        pass
+
+class SqliteTreeIndex(CsvTreeIndex):
+    '''Content and directory digests of an SQLite verification file, looked up with its indexes when they are needed'''
+
+    def __init__(self, baseline : SqliteBaseline):
+        self.baseline = baseline
+        self.connection = baseline.connect()
+        self.root_folder = None
+        if self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'trees'").fetchone() is not None:
+            record = self.connection.execute("SELECT path FROM trees ORDER BY seq DESC LIMIT 1").fetchone()
+            self.root_folder = None if record is None else record[0]
+
+    def tree_digest(self, relative_path : str) -> str:
+        path = os.path.join(self.root_folder, relative_path) if relative_path else self.root_folder
+        record = self.connection.execute("SELECT digest FROM trees WHERE path = ?", (path,)).fetchone()
+        return None if record is None else record[0].hex()
+
+    def children(self, relative_path : str) -> list:
+        # the parent column holds os.path.dirname of the path, which has no trailing separator
+        parent = os.path.dirname(os.path.join(self.root_folder, relative_path, "_"))
+        cursor = self.connection.execute(self.baseline.select_entries(self.connection) + " WHERE parent = ? ORDER BY seq",
+                                         (parent,))
+        return [self.baseline.to_row(record) for record in cursor]
+
+    def close(self):
+        self.connection.close()
+
+def compare_trees(old_index, new_index, comparator : VerificationComparator) -> tuple:
+    '''Compares two verification files of the same tree (see CsvTreeIndex), reporting the differences to comparator.
+    Starting from the root folder, only the directories whose digests differ are descended into, so the cost
+    depends on the number of changes rather than on the size of the tree. Paths are matched relative to the
+    root folders, which may differ (e.g. two snapshots of the same file system mounted in different places).
+    It returns the number of directories that have been descended into and the number that have been skipped'''
+    num_descended = 0
+    num_skipped = 0
+    stack = [""]
+    while stack:
+        relative_path = stack.pop()
+        if old_index.tree_digest(relative_path) == new_index.tree_digest(relative_path):
+            num_skipped += 1
+            continue
+        num_descended += 1
+        # the content of a directory is sorted in walk order: (kind, name) with the directories first
+        old_children = {(0 if row_is_dir(row) else 1, row[0]): row for row in old_index.children(relative_path)}
+        new_children = {(0 if row_is_dir(row) else 1, row[0]): row for row in new_index.children(relative_path)}
+        subdirs = []
+        for key in sorted(old_children.keys() | new_children.keys()):
+            old_row, row = old_children.get(key), new_children.get(key)
+            if row is None:
+                report_subtree(old_index, old_row, comparator.deleted)
+            elif old_row is None:
+                report_subtree(new_index, row, lambda added_row: comparator.added(added_row[PATH_COLUMN], added_row))
+            else:
+                comparator.compare(old_row, row)
+                if key[0] == 0:
+                    subdirs.append(os.path.join(relative_path, key[1]))
+        stack.extend(reversed(subdirs))
+    return num_descended, num_skipped
+
+def report_subtree(index, row : list, report):
+    '''Calls report on row and, if it is a directory, on all of its content (in walk order)'''
+    stack = [iter([row])]
+    while stack:
+        row = next(stack[-1], None)
+        if row is None:
+            stack.pop()
+            continue
+        report(row)
+        if row_is_dir(row):
+            stack.append(iter(index.children(index.relative(row[PATH_COLUMN]))))
+
+#------------ Scheduled verification ------------
+
+# Hashing throughput (bytes per second) assumed by the scheduled verification until it has measured one
+DEFAULT_THROUGHPUT = 100 * 1000 * 1000
+
+def shard_of(path : str, root_folder : str, num_shards : int) -> int:
+    '''Returns the shard of a path of root_folder: the CRC32 of the path relative to root_folder modulo num_shards,
+    so a file always belongs to the same shard, from one run to the next'''
+    return zlib.crc32(path[len(root_folder):].lstrip(os.sep).encode("utf-8", "surrogateescape")) % num_shards
+
+class VerificationSchedule:
+    '''State of the scheduled verification, kept in a JSON file between runs: the shard the next run starts from
+    (cursor), when every shard was last re-hashed, the number of bytes of every shard and the measured throughput.
+    Every run re-hashes the shards from the cursor on that fit in its budget, plus every shard that hasn't been
+    re-hashed for rotation_period seconds (even if it goes over the budget), so every file is covered within the
+    rotation period as long as a run is scheduled often enough'''
+
+    def __init__(self, path : str, num_shards : int, rotation_period : float):
+        self.path = path
+        self.num_shards = num_shards
+        self.rotation_period = rotation_period
+        state = None
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state.get("num_shards") != num_shards: # the files belong to other shards now, start again
+                print(f"The number of shards has changed, the schedule in {path} starts again")
+                state = None
+        if state is None:
+            state = {"created": time.time(), "cursor": 0, "last_verified": [None] * num_shards,
+                     "shard_bytes": None, "throughput": None}
+        self.created = state["created"]
+        self.cursor = state["cursor"]
+        self.last_verified = state["last_verified"]
+        self.shard_bytes = state["shard_bytes"]
+        self.throughput = state["throughput"]
+
+    def age(self, shard : int, now : float) -> float:
+        '''Seconds since the shard was last re-hashed (since the schedule was created, if it never was)'''
+        last_verified = self.last_verified[shard]
+        return now - (self.created if last_verified is None else last_verified)
+
+    def select(self, byte_budget : float, now : float) -> list:
+        '''Returns the shards to re-hash in this run (at least one), in order from the cursor'''
+        selected = []
+        total_bytes = 0
+        for i in range(self.num_shards):
+            shard = (self.cursor + i) % self.num_shards
+            overdue = self.age(shard, now) >= self.rotation_period
+            if selected and not overdue and total_bytes + self.shard_bytes[shard] > byte_budget:
+                break
+            selected.append(shard)
+            total_bytes += self.shard_bytes[shard]
+        return selected
+
+    def update(self, selected : list, shard_bytes : list, bytes_hashed : int, elapsed : float, now : float):
+        '''Records the result of a run and saves the state'''
+        for shard in selected:
+            self.last_verified[shard] = now
+        self.cursor = (selected[-1] + 1) % self.num_shards
+        self.shard_bytes = shard_bytes
+        if bytes_hashed > 0 and elapsed > 0:
+            self.throughput = bytes_hashed / elapsed
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"num_shards": self.num_shards, "created": self.created, "cursor": self.cursor,
+                       "last_verified": self.last_verified, "shard_bytes": self.shard_bytes,
+                       "throughput": self.throughput}, f)
+        os.replace(temp_path, self.path)
+
+    def coverage(self, now : float) -> float:
+        '''Returns the fraction of the bytes that have been re-hashed within the rotation period'''
+        total_bytes = sum(self.shard_bytes)
+        if total_bytes == 0:
+            return 1.0
+        covered = sum(size for shard, size in enumerate(self.shard_bytes)
+                      if self.last_verified[shard] is not None and now - self.last_verified[shard] < self.rotation_period)
+        return covered / total_bytes
+
+def baseline_shard_bytes(rows, root_folder : str, num_shards : int) -> list:
+    '''Returns the number of bytes of every shard according to the rows of a verification file (used for the first
+    scheduled run, the following ones reuse the sizes seen by the previous run)'''
+    shard_bytes = [0] * num_shards
+    for row in rows:
+        if not row_is_dir(row):
+            shard_bytes[shard_of(row[PATH_COLUMN], root_folder, num_shards)] += int(row[1])
+    return shard_bytes
+
+class ScheduledFingerprints:
+    '''Fast verification lookup (see BaselineReader.get) that never trusts the files of the selected shards,
+    so they are always re-hashed, while every other file is only re-hashed if its fingerprint changed'''
+
+    def __init__(self, fingerprints, root_folder : str, num_shards : int, selected : list):
+        self.fingerprints = fingerprints
+        self.root_folder = root_folder
+        self.num_shards = num_shards
+        self.selected = set(selected)
+
+    def get(self, path : str):
+        if shard_of(path, self.root_folder, self.num_shards) in self.selected:
+            return None
+        return self.fingerprints.get(path)
+
+    def close(self):
+        self.fingerprints.close()
+
+class ScheduledComparator(VerificationComparator):
+    '''VerificationComparator that also counts the files and bytes of every shard in the live walk'''
+
+    def __init__(self, baseline : BaselineReader, num_shards : int, selected : list, report = None,
+                 max_warnings : int = None, block_size : int = None):
+        super().__init__(baseline, report, max_warnings, block_size)
+        self.num_shards = num_shards
+        self.selected = set(selected)
+        self.shard_bytes = [0] * num_shards
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+
+    def writerow(self, row : list):
+        if row[1] is not None:
+            shard = shard_of(row[PATH_COLUMN], self.baseline.root_folder, self.num_shards)
+            self.shard_bytes[shard] += row[1]
+            if shard in self.selected:
+                self.files_hashed += 1
+                self.bytes_hashed += row[1]
+        super().writerow(row)
+
+#------------ Resumable initialization ------------
+
+def estimated_tree_bytes(baseline, root_folder : str) -> int:
+    '''Returns an estimate of the number of bytes to hash in root_folder, for the progress of the initialization:
+    the size of its files in the previous verification file, or None if there is none (or it is of another tree)'''
+    if not os.path.isfile(baseline.path):
+        return None
+    prefix = root_folder.rstrip(os.sep) + os.sep
+    total = None
+    for row in baseline.rows():
+        if not row_is_dir(row) and row[PATH_COLUMN].startswith(prefix):
+            total = (total or 0) + int(row[1])
+    return total
+
+def format_duration(seconds : float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class InitCheckpoint:
+    '''Periodic checkpoints of an initialization, so that an interrupted run can be resumed with --resume.
+    It wraps the writer of the verification file (behind MerkleBuilder): every interval seconds the writer is
+    flushed to disk and the position to resume from, the path_sort_key of the last row and the counters are
+    saved to a JSON file. A resumed run truncates the partial verification file to that position, replays its
+    rows into a new MerkleBuilder (so the directory digests don't need to be saved) and walks only what comes
+    after the last row, so the verification file is the same as the one of an uninterrupted run.
+    If progress is True, the number of bytes hashed so far and the hashing rate are printed every few seconds,
+    with the percentage and the estimated time left if the total number of bytes is estimated (total_bytes)'''
+
+    # seconds between two progress lines
+    progress_interval = 5
+
+    def __init__(self, path : str, writer, root_folder : str, settings : dict, interval : float, progress : bool,
+                 state : dict = None, total_bytes : int = None):
+        self.path = path
+        self.writer = writer
+        self.root_folder = root_folder
+        self.settings = settings # options that must be the same when the run is resumed
+        self.interval = interval
+        self.progress = progress
+        state = state or {}
+        self.num_files = state.get("num_files", 0)
+        self.num_dirs = state.get("num_dirs", 0)
+        self.bytes_done = state.get("bytes_done", 0)
+        self.bytes_resumed = self.bytes_done
+        self.last_row = None
+        self.start = self.last_save = self.last_progress = time.monotonic()
+        self.total_bytes = total_bytes
+
+    @staticmethod
+    def load(path : str) -> dict:
+        '''Returns the state saved by the last checkpoint, or None if there is none'''
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            state = json.load(f)
+        state["last_key"] = tuple(tuple(pair) for pair in state["last_key"])
+        return state
+
+    def writerow(self, row : list):
+        self.writer.writerow(row)
+        self.last_row = row
+        if row[1] in (None, ""):
+            self.num_dirs += 1
+        else:
+            self.num_files += 1
+            self.bytes_done += int(row[1])
+        now = time.monotonic()
+        if now - self.last_save >= self.interval:
+            self.save()
+            self.last_save = now
+        if self.progress and now - self.last_progress >= self.progress_interval:
+            self.show_progress(now)
+            self.last_progress = now
+
+    def write_tree_digest(self, path : str, digest : str):
+        self.writer.write_tree_digest(path, digest)
+
+    def save(self):
+        if self.last_row is None:
+            return
+        state = {"settings": self.settings,
+                 "position": self.writer.checkpoint(),
+                 "last_key": path_sort_key(self.last_row[PATH_COLUMN], self.root_folder, self.last_row[1] in (None, "")),
+                 "num_files": self.num_files,
+                 "num_dirs": self.num_dirs,
+                 "bytes_done": self.bytes_done}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def show_progress(self, now : float):
+        text = f"Progress: {self.num_files} files and {self.bytes_done / 1e6:.1f} MB"
+        if self.total_bytes:
+            text += f" of about {self.total_bytes / 1e6:.1f} MB ({100 * min(self.bytes_done / self.total_bytes, 1):.1f}%)"
+        rate = (self.bytes_done - self.bytes_resumed) / (now - self.start)
+        text += f", {rate / 1e6:.1f} MB/s"
+        if self.total_bytes and rate > 0:
+            text += f", about {format_duration(max(self.total_bytes - self.bytes_done, 0) / rate)} left"
+        print(text, flush=True)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+#------------ Watch mode (Linux inotify) ------------
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+# events that can change a row of the verification file
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+class Inotify:
+    '''Minimal binding of the Linux inotify API through ctypes, so that no third-party package is needed'''
+
+    EVENT = struct.Struct("iIII") # wd, mask, cookie, len (followed by len bytes of name)
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise Exception("Watch mode needs the Linux inotify API")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path : str, mask : int = WATCH_MASK) -> int:
+        '''Watches the directory path and returns its watch descriptor. When the limit of watches
+        (fs.inotify.max_user_watches) is reached an OSError with errno ENOSPC is raised'''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove_watch(self, wd : int):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout : float) -> list:
+        '''Waits up to timeout seconds and returns all the pending events as (wd, mask, name) tuples'''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        while readable:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError: # no more events
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                events.append((wd, mask, os.fsdecode(data[offset : offset + length].rstrip(b"\0"))))
+                offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class WatchComparator(VerificationComparator):
+    '''VerificationComparator that remembers what it has already reported for every path, so that a change
+    is printed once and not again at every event of the same path (until the path changes again)'''
+
+    def __init__(self, block_size : int = None):
+        super().__init__(None, block_size=block_size)
+        self.reported = {}
+
+    def report_once(self, path : str, state) -> bool:
+        if self.reported.get(path) == state:
+            return False
+        self.reported[path] = state
+        return True
+
+    def modified(self, path : str, changes : list, changed_ranges : list = None):
+        if self.report_once(path, tuple(changes)):
+            super().modified(path, changes, changed_ranges)
+
+    def added(self, path : str, row : list = None):
+        if self.report_once(path, "added"):
+            super().added(path, row)
+
+    def deleted(self, row : list):
+        if self.report_once(row[PATH_COLUMN], "deleted"):
+            super().deleted(row)
+
+    def unchanged(self, path : str):
+        self.reported.pop(path, None)
+
+class Watcher:
+    '''Continuous monitoring of root_folder (watch mode).
+    The verification file is loaded once and every directory of the tree is watched with inotify. Only the
+    paths that receive events are stat-ed again (and re-hashed, if their fingerprint changed), after a burst
+    of events has calmed down for debounce seconds. Warnings are printed like in verification mode.
+    If the kernel queue overflows the whole tree is rescanned; directories that can't be watched because
+    of the watch limit are rescanned every rescan_interval seconds instead. Every checkpoint_interval
+    seconds (0 to disable) a full verification of the tree is done and the report file is rewritten.
+    symlinks and walk_filter are the walk options of the verification file (see baseline_walk)'''
+
+    def __init__(self, root_folder : str, baseline, hash_name : str, reportFilePath : str, jobs : int = 1,
+                 use_processes : bool = False, chunk_size : int = DEFAULT_CHUNK_SIZE, paranoid : bool = False,
+                 fast_checkpoints : bool = False, debounce : float = 0.5, checkpoint_interval : float = 3600,
+                 rescan_interval : float = 60, walk_filter : WalkFilter = None, block_size : int = None,
+                 symlinks : str = "follow"):
+        self.root_folder = root_folder
+        self.walk_filter = walk_filter # the paths it excludes are neither watched nor checked
+        self.symlinks = symlinks
+        self.baseline_path = baseline.path
+        self.rows = {row[PATH_COLUMN]: row for row in baseline.rows()}
+        self.hash_name = hash_name
+        self.constructor = HASH_FUNCTIONS[hash_name]
+        self.block_size = block_size # of the files hashed in blocks, like in the verification file
+        self.reportFilePath = reportFilePath
+        self.jobs = jobs
+        self.use_processes = use_processes
+        self.chunk_size = chunk_size
+        self.paranoid = paranoid
+        self.fast_checkpoints = fast_checkpoints
+        self.debounce = debounce
+        self.checkpoint_interval = checkpoint_interval
+        self.rescan_interval = rescan_interval
+        self.comparator = WatchComparator(block_size)
+        self.inotify = Inotify()
+        self.watches = {}       # watch descriptor -> directory
+        self.watched = {}       # directory -> watch descriptor
+        self.unwatched = set()  # directories over the watch limit, rescanned periodically
+        self.dirty = set()      # paths that received events since the last check
+        self.overflow = False
+        self.last_checkpoint = None # (number of files, number of directories, comparator) of the last full verification
+        self.start_time = time.time()
+
+    def get(self, path : str):
+        '''Fast verification lookup of scan_folder, answered from the loaded verification file'''
+        row = self.rows.get(path)
+        if self.paranoid or row is None:
+            return None
+        return row_fingerprint(row)
+
+    def add_watches(self, top : str):
+        '''Watches top and all the directories below it. A directory over the watch limit is added to
+        unwatched (with its whole subtree) instead'''
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            if directory in self.watched:
+                continue
+            try:
+                wd = self.inotify.add_watch(directory)
+            except OSError as e:
+                if e.errno == errno_module.ENOSPC:
+                    self.unwatched.add(directory)
+                continue # the directory vanished or can't be read: its events will tell
+            if self.watches.get(wd, directory) != directory: # same directory, reached through a new path (moved)
+                self.watched.pop(self.watches[wd], None)
+            self.watches[wd] = directory
+            self.watched[directory] = wd
+            self.unwatched.discard(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries
+                                 if entry_is_dir(entry, self.symlinks == "follow") and self.walks_into(entry.path))
+            except OSError:
+                pass
+
+    def walks_into(self, directory : str) -> bool:
+        '''Returns False if the walk filter leaves out the directory or its content'''
+        if self.walk_filter is None:
+            return True
+        return not self.walk_filter.excludes(directory, True) and self.walk_filter.descends(directory, os.stat(directory))
+
+    def handle(self, events : list):
+        '''Records the paths touched by a list of inotify events'''
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW: # events have been lost
+                self.overflow = True
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED: # the watch has been removed (directory deleted or moved away)
+                del self.watches[wd]
+                if self.watched.get(directory) == wd:
+                    del self.watched[directory]
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_MOVED_FROM and mask & IN_ISDIR:
+                # the watches below a moved directory would keep reporting its old path
+                self.remove_watches(path)
+            self.dirty.add(path)
+
+    def remove_watches(self, top : str):
+        '''Stops watching top and all the directories below it'''
+        prefix = top + os.sep
+        for directory in [d for d in self.watched if d == top or d.startswith(prefix)]:
+            wd = self.watched.pop(directory)
+            self.watches.pop(wd, None)
+            self.inotify.remove_watch(wd)
+
+    def process(self):
+        '''Checks all the paths that received events'''
+        if self.overflow:
+            print("The inotify queue overflowed, rescanning the whole tree")
+            self.dirty.clear()
+            self.overflow = False
+            self.rescan(self.root_folder)
+            return
+        dirty = sorted(self.dirty) # parents before their content
+        self.dirty.clear()
+        for path in dirty:
+            try:
+                self.check(path)
+            except OSError as e: # the path changed while it was being checked, the next event will tell
+                print(f"Could not check {path}: {e}")
+
+    def check(self, path : str):
+        '''Compares a single path with the verification file'''
+        if path == self.root_folder or not path.startswith(self.root_folder):
+            return
+        try:
+            st = stat_entry(path, self.symlinks == "follow") # like in walk_tree
+        except FileNotFoundError:
+            st = None
+        if st is not None and self.walk_filter is not None:
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if self.walk_filter.excludes(path, is_dir) or (not is_dir and self.walk_filter.excludes_size(st.st_size)):
+                st = None # out of the walk, like in verification mode
+        old_row = self.rows.get(path)
+        if st is None:
+            if old_row is None:
+                self.comparator.unchanged(path) # created and deleted again
+            elif row_is_dir(old_row):
+                self.rescan(path)
+            else:
+                self.comparator.deleted(old_row)
+            return
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if is_dir and path not in self.watched and self.walks_into(path):
+            # new (or moved in) directory, its content must be looked at too
+            self.add_watches(path)
+            self.rescan(path)
+            return
+        if old_row is not None and row_is_dir(old_row) != is_dir: # replaced by something of another type
+            self.rescan(path)
+            return
+        row = entry_row(os.path.basename(path), path, st, is_dir, None, None)
+        if old_row is None:
+            self.comparator.added(path)
+            return
+        if not is_dir:
+            trusted = self.get(path)
+            if trusted is not None and trusted[0] == stat_fingerprint(st):
+                row[6], row[BLOCKS_COLUMN] = trusted[1], trusted[2] or None
+            elif stat.S_ISLNK(st.st_mode): # a link that isn't followed (or is broken), like in scan_folder
+                row[6] = self.constructor(os.fsencode(os.readlink(path))).hexdigest()
+            else:
+                store_digest(row, hash_file(path, self.constructor, self.chunk_size, st.st_size, self.block_size, self.jobs))
+        self.comparator.compare(old_row, row)
+
+    def rows_under(self, top : str) -> list:
+        '''Returns the rows of the verification file below top, in walk order'''
+        if top == self.root_folder:
+            return list(self.rows.values())
+        prefix = top.rstrip(os.sep) + os.sep
+        return [row for path, row in self.rows.items() if path.startswith(prefix)]
+
+    def rescan(self, top : str):
+        '''Targeted rescan of the subtree top (a merge-join with the rows of the verification file below it)'''
+        rows = self.rows_under(top)
+        if top != self.root_folder:
+            old_row = self.rows.get(top)
+            st = stat_entry(top, self.symlinks == "follow") if os.path.lexists(top) else None
+            if st is None or not stat.S_ISDIR(st.st_mode): # the directory doesn't exist anymore (or isn't a directory now)
+                self.unwatched.discard(top)
+                for row in rows:
+                    self.comparator.deleted(row)
+                if old_row is not None:
+                    self.comparator.deleted(old_row)
+                if os.path.lexists(top):
+                    self.comparator.added(top)
+                return
+            if old_row is None:
+                self.comparator.added(top)
+            elif not row_is_dir(old_row):
+                self.comparator.deleted(old_row)
+                self.comparator.added(top)
+            else:
+                self.comparator.compare(old_row, entry_row(os.path.basename(top), top, st, True, None, None))
+        self.comparator.baseline = BaselineReader(rows, top)
+        try:
+            scan_folder(top, self.comparator, self, self.jobs, self.use_processes, resolve_names=False,
+                        chunk_size=self.chunk_size, symlinks=self.symlinks, walk_filter=self.walk_filter,
+                        hash_name=self.hash_name, block_size=self.block_size)
+            self.comparator.close()
+        except OSError as e:
+            print(f"Could not rescan {top}: {e}")
+
+    def checkpoint(self):
+        '''Full verification of the whole tree, whose result is written to the report file'''
+        print("------------ Checkpoint: full verification of the directory ------------")
+        comparator = VerificationComparator(BaselineReader(self.rows.values(), self.root_folder), block_size=self.block_size)
+        fingerprints = self if self.fast_checkpoints else None
+        num_files, num_dirs, _ = scan_folder(self.root_folder, comparator, fingerprints, self.jobs, self.use_processes,
+                                             resolve_names=False, chunk_size=self.chunk_size, symlinks=self.symlinks,
+                                             walk_filter=self.walk_filter, hash_name=self.hash_name, block_size=self.block_size)
+        comparator.close()
+        self.last_checkpoint = (num_files, num_dirs, comparator)
+        self.write_report()
+
+    def write_report(self):
+        with open(self.reportFilePath, "w") as rf:
+            rf.write(f"The full path of the monitored directory is {self.root_folder}\n")
+            rf.write(f"The full path of the verification file is {self.baseline_path}\n")
+            rf.write(f"The full path of this report file is {self.reportFilePath}\n")
+            rf.write(f"Overall, {len(self.watched)} directories are watched and {len(self.unwatched)} subtrees are over the watch limit\n")
+            rf.write(f"Overall, {self.comparator.num_warnings} warnings have been issued in watch mode\n")
+            if self.last_checkpoint is not None:
+                num_files, num_dirs, comparator = self.last_checkpoint
+                rf.write(f"The last full verification scanned {num_dirs} directories containing a total of {num_files} files "
+                         f"and issued {comparator.num_warnings} warnings\n")
+            rf.write(f"The total time spent in watch mode is {time.time() - self.start_time} (seconds)\n")
+
+    def run(self, duration : float = None):
+        '''Watches the tree until duration seconds have passed (forever if None) or until Ctrl-C'''
+        self.add_watches(self.root_folder)
+        print(f"Watching {len(self.watched)} directories ({len(self.unwatched)} subtrees over the watch limit)")
+        start = last_checkpoint = last_rescan = time.monotonic()
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                events = self.inotify.read_events(timeout=min(1.0, self.debounce * 2))
+                if events:
+                    # debounce: keep collecting until the burst calms down (at most 10 times the debounce delay)
+                    burst_start = time.monotonic()
+                    while events:
+                        self.handle(events)
+                        if time.monotonic() - burst_start >= 10 * self.debounce:
+                            break
+                        events = self.inotify.read_events(timeout=self.debounce)
+                    self.process()
+                now = time.monotonic()
+                if self.unwatched and now - last_rescan >= self.rescan_interval:
+                    last_rescan = now
+                    for top in sorted(self.unwatched):
+                        self.add_watches(top) # maybe some watches have been freed in the meanwhile
+                        self.rescan(top)
+                if self.checkpoint_interval and now - last_checkpoint >= self.checkpoint_interval:
+                    last_checkpoint = now
+                    self.checkpoint()
+        except KeyboardInterrupt:
+            print("Watch mode interrupted")
+        finally:
+            self.inotify.close()
+            self.write_report()
+
+#------------ Python API ------------
+# Scanner and Verifier do what initialization and verification mode do, for programs that import SIV and check
+# many trees (or the same tree many times) in a single long-running process. The command line uses them too.
+
+class ScanStopped(Exception):
+    '''Raised by the emit function of generate() once the generator has been closed, to stop the function it runs'''
+
+def generate(run, batch_size : int = 1, max_batches : int = 64):
+    '''Turns run(emit), which calls emit(item) for every item it produces, into a generator of those items.
+    run is called in a thread of its own, which waits whenever max_batches batches of batch_size items are
+    waiting to be consumed, so memory doesn't grow with the number of items. The value returned by run is
+    the return value of the generator, an exception raised by run is raised by the generator and closing
+    the generator before the end stops run (emit raises ScanStopped)'''
+    handover = queue.Queue(max_batches)
+    stopped = threading.Event()
+    batch = []
+
+    def put(message : tuple):
+        while not stopped.is_set():
+            try:
+                handover.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise ScanStopped()
+
+    def emit(item):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            put(("items", batch.copy()))
+            batch.clear()
+
+    def target():
+        try:
+            result = run(emit)
+            put(("items", batch.copy()))
+            put(("return", result))
+        except ScanStopped:
+            pass
+        except BaseException as e:
+            try:
+                put(("raise", e))
+            except ScanStopped:
+                pass
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = handover.get()
+            if kind == "items":
+                yield from value
+            elif kind == "return":
+                return value
+            else:
+                raise value
+    finally:
+        stopped.set()
+        thread.join()
+
+class CallbackWriter:
+    '''Writer (see scan_folder) that passes every row to a function'''
+
+    def __init__(self, function):
+        self.writerow = function
+
+class ChangeEvents(ChangeReport):
+    '''ChangeReport that passes every change (a dict) to a function instead of writing it to a file'''
+
+    def __init__(self, function):
+        self.write = function
+
+class CachingComparator(VerificationComparator):
+    '''VerificationComparator of Verifier.verify: it doesn't print the warnings and, if digests is given, remembers in it
+    the fingerprint and digest of every file whose fingerprint differs from the verification file (see CachedFingerprints)'''
+
+    verbose = False
+
+    def __init__(self, baseline : BaselineReader, report, max_warnings : int = None, digests : dict = None,
+                 block_size : int = None):
+        super().__init__(baseline, report, max_warnings, block_size)
+        self.digests = digests
+
+    def remember(self, row : list, old_row : list = None):
+        if self.digests is None or row is None or row[1] in (None, ""):
+            return
+        trusted = row_fingerprint(row)
+        if old_row is not None and trusted is not None and row_fingerprint(old_row) == trusted:
+            self.digests.pop(row[PATH_COLUMN], None) # the verification file is up to date again
+        elif trusted is not None:
+            self.digests[row[PATH_COLUMN]] = trusted
+
+    def compare(self, old_row : list, row : list):
+        self.remember(row, old_row)
+        super().compare(old_row, row)
+
+    def added(self, path : str, row : list = None):
+        self.remember(row)
+        super().added(path, row)
+
+    def deleted(self, row : list):
+        if self.digests is not None:
+            self.digests.pop(row[PATH_COLUMN], None)
+        super().deleted(row)
+
+class CachedFingerprints:
+    '''Fast verification lookup (see BaselineReader.get) that prefers the digests remembered by a previous run'''
+
+    def __init__(self, fingerprints, digests : dict):
+        self.fingerprints = fingerprints
+        self.digests = digests
+
+    def get(self, path : str):
+        trusted = self.fingerprints.get(path) # asked for anyway, the lookups of a BaselineReader follow the walk
+        return self.digests.get(path, trusted)
+
+    def close(self):
+        self.fingerprints.close()
+
+class Scanner:
+    '''Scans directory trees like initialization mode:
+
+        with SIV.Scanner("sha256", jobs=4, exclude=[".git"]) as scanner:
+            for row in scanner.scan("/srv/www"):
+                ...
+            scanner.create("/etc", "/var/lib/siv/etc")
+
+    A Scanner can scan any number of trees, any number of times. Its pool of hashing workers is kept between
+    calls, like the owner and group names (see owner_name), so a long-running service doesn't pay the startup
+    of a new run for every scan. symlinks is a SYMLINK_POLICIES policy, files larger than block_size (if given) are
+    hashed in blocks (see hash_file) and the other keyword arguments are the rules of WalkFilter; all of them are
+    written in the verification files that are created. trust_prefix is passed to scan_folder (it only matters
+    for fast verifications). close() (or the end of the with block) stops the workers'''
+
+    def __init__(self, hash_name : str = "sha1", jobs : int = 1, use_processes : bool = False,
+                 chunk_size : int = DEFAULT_CHUNK_SIZE, walkers : int = 1, symlinks : str = "follow",
+                 block_size : int = None, trust_prefix : bool = False, **filters):
+        if hash_name not in HASH_FUNCTIONS:
+            raise ValueError(f"The hashing function \"{hash_name}\" is not supported")
+        if symlinks not in SYMLINK_POLICIES:
+            raise ValueError(f"The symbolic link policy \"{symlinks}\" is not supported")
+        if block_size is not None and block_size <= 0:
+            raise ValueError("The block size must be a positive number of bytes")
+        unknown = set(filters) - set(WalkFilter.RULES)
+        if unknown:
+            raise TypeError(f"Unknown walk filters: {', '.join(sorted(unknown))}")
+        self.hash_name = hash_name
+        self.jobs = jobs
+        self.use_processes = use_processes
+        self.chunk_size = chunk_size
+        self.walkers = walkers
+        self.block_size = block_size
+        self.trust_prefix = trust_prefix
+        self.walk_options = {rule: filters.get(rule) for rule in WalkFilter.RULES}
+        self.walk_options["symlinks"] = symlinks
+        self.walk_options["block_size"] = block_size
+        # the sharded scan has hashing workers of its own, in every walker process
+        self.executor = make_executor(jobs, use_processes) if walkers <= 1 else None
+
+    def walk(self, root_folder : str) -> tuple:
+        '''Returns the symbolic link policy and the WalkFilter (or None) of a walk of root_folder'''
+        return self.walk_options["symlinks"], WalkFilter.from_options(root_folder, self.walk_options)
+
+    def write(self, root_folder : str, writer, fingerprints = None, baseline = None, resolve_names : bool = True,
+              walker = None, metrics : Metrics = None) -> tuple:
+        '''Scans root_folder into writer (any object with a writerow method, see scan_folder) and returns the number of
+        files, folders and trusted files. With walkers > 1 the fast verification lookups are done by every walker
+        in baseline, and fingerprints, walker and metrics are not used (see scan_folder_sharded)'''
+        symlinks, walk_filter = self.walk(root_folder)
+        if self.walkers > 1:
+            return scan_folder_sharded(root_folder, writer, self.walkers, baseline, self.jobs, resolve_names=resolve_names,
+                                       chunk_size=self.chunk_size, symlinks=symlinks, walk_filter=walk_filter,
+                                       hash_name=self.hash_name, block_size=self.block_size, trust_prefix=self.trust_prefix)
+        return scan_folder(root_folder, writer, fingerprints, self.jobs, self.use_processes, resolve_names=resolve_names,
+                           chunk_size=self.chunk_size, metrics=metrics, walker=walker, symlinks=symlinks,
+                           walk_filter=walk_filter, hash_name=self.hash_name, executor=self.executor,
+                           block_size=self.block_size, trust_prefix=self.trust_prefix)
+
+    def scan(self, root_folder : str):
+        '''Generator of the rows of root_folder (with the columns of verification_file_header), in walk order.
+        Its return value is the tuple returned by write'''
+        return (yield from generate(lambda emit: self.write(root_folder, CallbackWriter(emit)), batch_size=256))
+
+    def create(self, root_folder : str, verification_file : str, baseline_format : str = "csv") -> tuple:
+        '''Scans root_folder into a new verification file (with its directory digests) and returns the tuple returned
+        by write. Nothing is left behind if the scan fails'''
+        baseline = open_baseline(verification_file, baseline_format)
+        writer = baseline.create(self.hash_name, walk_options=self.walk_options)
+        try:
+            tree_builder = MerkleBuilder(writer, root_folder, self.hash_name)
+            counts = self.write(root_folder, tree_builder)
+            tree_builder.close()
+        except BaseException:
+            writer.abort()
+            if os.path.exists(writer.temp_path):
+                os.remove(writer.temp_path)
+            raise
+        writer.close()
+        return counts
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Verifier:
+    '''Verifies directory trees against a verification file like verification mode:
+
+        with SIV.Verifier("/var/lib/siv/www.csv", fast=True) as verifier:
+            for change in verifier.verify("/srv/www"):
+                alert(change)
+
+    The changes are dicts with the schema of the lines of ChangeReport. A Verifier can check its tree any
+    number of times: the verification file is read once and its rows are kept in memory (unless cache_baseline
+    is False, then they are read again by every run, in constant memory), its Scanner keeps the hashing workers
+    and the owner and group names and, with fast=True (see --fast-verify), the digests of the files that have changed
+    since the verification file are remembered too, so they are hashed again only if they change once more.
+    With trust_prefix (see --trust-appended-prefix) a fast verification only hashes the end of the files that
+    have grown. The verification file is read again if it has been replaced in the meanwhile'''
+
+    def __init__(self, verification_file : str, baseline_format : str = None, jobs : int = 1,
+                 use_processes : bool = False, chunk_size : int = DEFAULT_CHUNK_SIZE, walkers : int = 1,
+                 fast : bool = False, cache_baseline : bool = True, trust_prefix : bool = False):
+        self.baseline = open_baseline(verification_file, baseline_format)
+        self.settings = {"jobs": jobs, "use_processes": use_processes, "chunk_size": chunk_size, "walkers": walkers,
+                         "trust_prefix": trust_prefix}
+        self.fast = fast
+        self.cache_baseline = cache_baseline
+        self.scanner = None
+        self.version = None
+        self.refresh()
+
+    def refresh(self):
+        '''(Re)loads the verification file, if it has changed since it was loaded'''
+        st = os.stat(self.baseline.path)
+        version = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if version == self.version:
+            return
+        hash_name = self.baseline.read_hash_name()
+        walk_options = self.baseline.read_walk_options() or {}
+        if self.scanner is not None:
+            self.scanner.close()
+        self.scanner = Scanner(hash_name, **self.settings, **walk_options)
+        self.hash_name = hash_name
+        self.cached_rows = None
+        self.digests = {}
+        self.version = version
+
+    def rows(self):
+        if not self.cache_baseline:
+            return self.baseline.rows()
+        if self.cached_rows is None:
+            self.cached_rows = list(self.baseline.rows())
+        return self.cached_rows
+
+    def reader(self, root_folder : str) -> BaselineReader:
+        '''Returns a BaselineReader of the verification file, for the comparator of a run'''
+        return BaselineReader(self.rows(), root_folder)
+
+    def fingerprints(self, root_folder : str):
+        '''Returns the fast verification lookup (see BaselineReader.get) of a run'''
+        fingerprints = self.reader(root_folder) if self.cache_baseline else self.baseline.fingerprints(root_folder)
+        if self.digests:
+            return CachedFingerprints(fingerprints, self.digests)
+        return fingerprints
+
+    def compare(self, root_folder : str, comparator : VerificationComparator, fingerprints = None,
+                metrics : Metrics = None) -> tuple:
+        '''Scans root_folder into comparator and closes it, so that every change has been reported. fingerprints are
+        the fast verification lookups (see fingerprints), if any. Returns the number of files, folders and trusted files'''
+        if self.scanner.walkers > 1 and fingerprints is not None and not isinstance(self.baseline, SqliteBaseline):
+            raise Exception("--fast-verify with --walkers needs an SQLite verification file (see --convert-mode)")
+        counts = self.scanner.write(root_folder, comparator, fingerprints, self.baseline if fingerprints is not None else None,
+                                    resolve_names=False, metrics=metrics)
+        close_start = time.perf_counter_ns()
+        comparator.close()
+        if metrics is not None:
+            metrics.add("compare", time.perf_counter_ns() - close_start)
+        return counts
+
+    def verify(self, root_folder : str, max_warnings : int = None):
+        '''Generator of the changes of root_folder since the verification file, as soon as they are found. Its return
+        value is a dict with the number of files, directories, trusted files, deleted, added and modified paths and
+        whether the run has been stopped early by max_warnings'''
+        self.refresh()
+
+        def run(emit):
+            reader = self.reader(root_folder)
+            fingerprints = self.fingerprints(root_folder) if self.fast else None
+            comparator = CachingComparator(reader, ChangeEvents(emit), max_warnings, self.digests if self.fast else None,
+                                           self.scanner.block_size)
+            counts = (None, None, None)
+            stopped_early = False
+            try:
+                counts = self.compare(root_folder, comparator, fingerprints)
+            except WarningLimitReached:
+                stopped_early = True
+            finally:
+                reader.close()
+                if fingerprints is not None:
+                    fingerprints.close()
+            return {"files": counts[0], "directories": counts[1], "trusted": counts[2], "deleted": comparator.num_deleted,
+                    "added": comparator.num_added, "modified": comparator.num_modified, "stopped_early": stopped_early}
+
+        return (yield from generate(run))
+
+    def close(self):
+        self.scanner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 if __name__ == "__main__":
     
@@ -124,14 +2615,97 @@ to a report file specified by the user.'
     group1.add_argument('-h', '--help', action='help')
     group1.add_argument('-i', '--initialization-mode', action='store_true', help='Specifies that the script should be run in \"initialization mode\"')
     group1.add_argument('-v', '--verification-mode', action='store_true', help='Specifies that the script should be run in \"verification mode\"')
+    group1.add_argument('-w', '--watch-mode', action='store_true', help='Specifies that the script should keep watching the directory with inotify (Linux) and report changes as they happen')
+    group1.add_argument('-c', '--convert-mode', action='store_true', help='Converts the CSV verification file given with -V to the format given with --baseline-format (default: sqlite)')
+    group1.add_argument('-t', '--tree-compare-mode', action='store_true', help='Compares the verification file given with -V with the one given with --against (or with a fast snapshot of the directory given with -D), descending only into the directories whose digests differ')
 
-    parser.add_argument('-D', '--directory', action='store', type=str, required=True, help="Path to the directory that you want to monitor")
-    parser.add_argument('-R', '--report-file', action='store', type=str, required=True, help='Name of the report file (must be a .txt)')
+    parser.add_argument('-D', '--directory', action='store', type=str, help="Path to the directory that you want to monitor")
+    parser.add_argument('-R', '--report-file', action='store', type=str, help='Name of the report file (must be a .txt)')
     parser.add_argument('-V', '--verification-file', action='store', type=str, required=True, help='Name of the verification file')
-    parser.add_argument('-H', '--hash-function', action='store', type=str, choices=['sha1', 'md5'], help='Specifies the algorithm for the hash function')
+    parser.add_argument('-H', '--hash-function', action='store', type=str, choices=list(HASH_FUNCTIONS), help='Specifies the algorithm for the hash function')
+    parser.add_argument('-F', '--fast-verify', action='store_true', help='In verification mode, re-hash only the files whose size, inode, ctime or mtime changed since the baseline')
+    parser.add_argument('--trust-appended-prefix', action='store_true', help='In fast verification of a verification file hashed in blocks, assume that a file that has grown (same inode, larger size) has only been appended to and only hash its new blocks. A change before the old end of the file is not detected')
+    parser.add_argument('-S', '--scheduled', action='store_true', help='In verification mode, re-hash only the shards of the verification file that fit in --time-budget/--byte-budget (every other file gets the --fast-verify check)')
+    parser.add_argument('--time-budget', action='store', type=float, help='In scheduled verification, seconds of hashing per run (estimated from the throughput of the previous runs)')
+    parser.add_argument('--byte-budget', action='store', type=int, help='In scheduled verification, bytes re-hashed per run')
+    parser.add_argument('--rotation-period', action='store', type=float, default=7, help='In scheduled verification, days within which every file is re-hashed, even over the budget (default: 7)')
+    parser.add_argument('--shards', action='store', type=int, default=256, help='In scheduled verification, number of shards the files are split into (default: 256)')
+    parser.add_argument('--schedule-state', action='store', type=str, help='In scheduled verification, JSON file with the state of the schedule (default: the verification file followed by .schedule.json)')
+    parser.add_argument('-P', '--paranoid', action='store_true', help='In verification mode, always re-hash every file (overrides --fast-verify)')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1, help='Number of workers that hash files in parallel (default: 1)')
+    parser.add_argument('--chunk-size', action='store', type=int, default=DEFAULT_CHUNK_SIZE, help=f'Number of bytes read from a file at a time while hashing it (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--symlinks', action='store', type=str, choices=SYMLINK_POLICIES, help='In initialization mode, follow: walk the symbolic links to directories outside the tree, skipping loops; record: never follow symbolic links, record their target (default: follow). The other modes use the policy of the verification file')
+    parser.add_argument('--include', action='append', type=str, help='In initialization mode, only record the files that match this glob (can be repeated)')
+    parser.add_argument('--exclude', action='append', type=str, help='In initialization mode, leave out the files and directories that match this glob (can be repeated)')
+    parser.add_argument('--include-regex', action='append', type=str, help='Like --include, with a regular expression searched in the relative path')
+    parser.add_argument('--exclude-regex', action='append', type=str, help='Like --exclude, with a regular expression searched in the relative path')
+    parser.add_argument('--one-file-system', action='store_true', help='In initialization mode, don\'t walk directories on other file systems (mount points)')
+    parser.add_argument('--max-depth', action='store', type=int, help='In initialization mode, only walk this many levels below the directory')
+    parser.add_argument('--min-size', action='store', type=int, help='In initialization mode, leave out the files smaller than this many bytes')
+    parser.add_argument('--max-size', action='store', type=int, help='In initialization mode, leave out the files larger than this many bytes')
+    parser.add_argument('--block-size', action='store', type=int, help='In initialization mode, hash the files larger than this many bytes in blocks of this size, in parallel with --jobs threads, so that verification reports the byte ranges that have changed (e.g. 67108864)')
+    parser.add_argument('--resume', action='store_true', help='In initialization mode, continue an interrupted run from its last checkpoint')
+    parser.add_argument('--save-interval', action='store', type=float, default=60, help='In initialization mode, seconds between two checkpoints of the run (default: 60)')
+    parser.add_argument('--progress', action='store_true', help='In initialization mode, print the progress every few seconds (with the estimated time left if the tree already has a verification file)')
+    parser.add_argument('--walkers', action='store', type=int, default=1, help='Number of processes that walk and hash the tree in parallel, in initialization and verification mode (default: 1)')
+    parser.add_argument('--processes', action='store_true', help='Hash with a pool of processes instead of threads (better for trees with many small files)')
+    parser.add_argument('--debounce', action='store', type=float, default=0.5, help='In watch mode, seconds without events before a burst of events is processed (default: 0.5)')
+    parser.add_argument('--checkpoint-interval', action='store', type=float, default=3600, help='In watch mode, seconds between two full verifications of the directory, 0 to disable (default: 3600)')
+    parser.add_argument('--rescan-interval', action='store', type=float, default=60, help='In watch mode, seconds between two rescans of the directories over the inotify watch limit (default: 60)')
+    parser.add_argument('--watch-duration', action='store', type=float, help='In watch mode, stop after this many seconds (default: run until interrupted)')
+    parser.add_argument('--json-report', action='store', type=str, help='In verification and tree comparison mode, also streams every change to this file as JSON Lines (see ChangeReport for the schema)')
+    parser.add_argument('--max-warnings', action='store', type=int, help='In verification and tree comparison mode, stop as soon as this many warnings have been issued')
+    parser.add_argument('--metrics', action='store_true', help='Adds the time spent in every phase, the counters and the slowest files to the report file')
+    parser.add_argument('--metrics-json', action='store', type=str, help='Writes the same metrics as --metrics to this JSON file')
+    parser.add_argument('--slowest', action='store', type=int, default=10, help='Number of slowest files to hash kept in the metrics (default: 10)')
+    parser.add_argument('--profile', action='store', type=str, help='Profiles the run with cProfile and writes the statistics to this file (workers of --processes are not profiled)')
+    parser.add_argument('--against', action='store', type=str, help='In tree comparison mode, name of the newer verification file (format detected from the existing file, or given by its extension)')
+    parser.add_argument('--baseline-format', action='store', type=str, choices=list(BASELINE_FORMATS), help='Format of the verification file (default: csv in initialization mode, detected from the existing file in verification mode)')
  
     #------------ Parse all the received arguments ------------
     args = parser.parse_args() # Namespace for all the arguments
+    if (args.initialization_mode or args.verification_mode or args.watch_mode) and (args.directory is None or args.report_file is None):
+        parser.error("the following arguments are required: -D/--directory, -R/--report-file")
+    if args.scheduled and (args.time_budget is None and args.byte_budget is None):
+        parser.error("--scheduled needs --time-budget and/or --byte-budget")
+    if args.scheduled and args.paranoid:
+        parser.error("--scheduled and --paranoid are mutually exclusive")
+    if args.walkers > 1 and (args.processes or args.scheduled or args.metrics or args.metrics_json):
+        parser.error("--walkers can't be used together with --processes, --scheduled or metrics")
+    walk_options_given = (args.symlinks or args.include or args.exclude or args.include_regex or args.exclude_regex or
+                          args.one_file_system or args.max_depth is not None or args.min_size is not None or args.max_size is not None
+                          or args.block_size is not None)
+    if walk_options_given and not args.initialization_mode:
+        parser.error("--symlinks, --block-size and the filters can only be given in initialization mode, the other modes use the ones of the verification file")
+    if args.block_size is not None and args.block_size <= 0:
+        parser.error("--block-size must be a positive number of bytes")
+    if args.max_depth is not None and args.max_depth <= 0:
+        parser.error("--max-depth must be a positive number")
+    if args.resume and args.walkers > 1:
+        parser.error("--resume can't be used together with --walkers (a checkpoint of a run with --walkers can be resumed without it)")
+    if (args.json_report or args.max_warnings is not None) and not (args.verification_mode or args.tree_compare_mode):
+        parser.error("--json-report and --max-warnings can only be given in verification and tree comparison mode")
+    if args.max_warnings is not None and args.max_warnings <= 0:
+        parser.error("--max-warnings must be a positive number")
+    if args.shards <= 0:
+        parser.error("--shards must be a positive number")
+    if args.tree_compare_mode and args.report_file is None:
+        parser.error("the following arguments are required: -R/--report-file")
+    if args.tree_compare_mode and args.against is None and args.directory is None:
+        parser.error("tree comparison mode needs either --against or -D/--directory")
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size must be a positive number of bytes")
+    if args.trust_appended_prefix and not (args.verification_mode and (args.fast_verify or args.scheduled) and not args.paranoid):
+        parser.error("--trust-appended-prefix can only be given in fast (or scheduled) verification mode, without --paranoid")
+
+    #------------ Optional instrumentation ------------
+    metrics = None
+    if args.metrics or args.metrics_json:
+        metrics = Metrics(args.slowest)
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     #------------ Start of initialization mode ------------
     if args.initialization_mode == True:
@@ -156,23 +2730,72 @@ to a report file specified by the user.'
                 elif check_if_file_is_inside_folder(reportFilePath, dirPath): # if true, file location is inside
                     raise Exception(f"The report file specified by {reportFilePath} cannot be inside the folder {dirPath}")
                 else:
-                    if hashFun != "md5" and hashFun != "sha1":
+                    if hashFun not in HASH_FUNCTIONS:
                         raise Exception(f"The hashing function \"{hashFun}\" is not supported.\nType \'siv --help\' for available hashing functions")
                     else:
                         #------------ If everything is fine, write to the verification file ------------
-                        with open(verFilePath + ".csv", "w", newline="") as csv_file:
-                            writer = csv.writer(csv_file)
-                            writer.writerow(['Name', 'Size (B)', 'Owner', 'Group', 'Permission levels', 'Last modification date time', 'Hash ('+hashFun+')', 'Path'])
-                            num_files, num_dirs = scan_folder(dirPath, writer)
-                            print(f"In total {num_files} files and {num_dirs} directories have been scanned!")
-                            end_time = time.time()
-                            total_time_initialization_mode = end_time - start_time
+                        baseline = open_baseline(verFilePath, args.baseline_format or "csv")
+                        # checkpoints of the run, so that it can be resumed if it is interrupted
+                        # the symbolic link policy and the filters are written in the verification file
+                        scanner = Scanner(hashFun, args.jobs, args.processes, args.chunk_size, args.walkers,
+                                          args.symlinks or "follow", args.block_size, include=args.include or [], exclude=args.exclude or [],
+                                          include_regex=args.include_regex or [], exclude_regex=args.exclude_regex or [],
+                                          one_file_system=args.one_file_system, max_depth=args.max_depth,
+                                          min_size=args.min_size, max_size=args.max_size)
+                        walk_options = scanner.walk_options
+                        symlinks, walk_filter = scanner.walk(dirPath)
+                        checkpoint_path = baseline.path + ".checkpoint.json"
+                        settings = {"root_folder": dirPath, "hash_name": hashFun, "walk_options": walk_options}
+                        state = None
+                        if args.resume:
+                            state = InitCheckpoint.load(checkpoint_path)
+                            if state is None:
+                                raise Exception(f"There is no checkpoint to resume from ({checkpoint_path} doesn't exist)")
+                            if state["settings"] != settings:
+                                raise Exception(f"The checkpoint has been written with other settings: {state['settings']}")
+                        writer = baseline.create(hashFun, None if state is None else state["position"], walk_options)
+                        # the progress is estimated from the previous verification file of the tree, if there is one
+                        total_bytes = estimated_tree_bytes(baseline, dirPath) if args.progress else None
+                        checkpoint = InitCheckpoint(checkpoint_path, writer, dirPath, settings, args.save_interval,
+                                                    args.progress, state, total_bytes)
+                        if state is None: # a checkpoint left by another run doesn't describe the new file
+                            checkpoint.remove()
+                        try:
+                            # the digest of every directory is computed while its rows are written
+                            tree_builder = MerkleBuilder(checkpoint, dirPath, hashFun)
+                            walker = None
+                            if state is not None:
+                                print(f"Resuming after {state['num_files']} files and {state['num_dirs']} directories...")
+                                for row in writer.rows():
+                                    tree_builder.replay(row)
+                                walker = walk_tree(dirPath, symlinks=symlinks, skip_until=state["last_key"], walk_filter=walk_filter)
+                            scanner.write(dirPath, tree_builder, walker=walker, metrics=metrics)
+                            tree_builder.close()
+                        except BaseException:
+                            # keep the partial verification file, up to the last checkpoint, for --resume
+                            writer.abort()
+                            if os.path.isfile(checkpoint_path):
+                                print("The initialization has been interrupted, run it again with --resume to continue it")
+                            raise
+                        finally:
+                            scanner.close()
+                        close_start = time.perf_counter_ns()
+                        writer.close()
+                        checkpoint.remove()
+                        if metrics is not None:
+                            metrics.add("write", time.perf_counter_ns() - close_start)
+                        num_files, num_dirs = checkpoint.num_files, checkpoint.num_dirs
+                        print(f"In total {num_files} files and {num_dirs} directories have been scanned!")
+                        end_time = time.time()
+                        total_time_initialization_mode = end_time - start_time
                         #------------ Write the report file ------------
                         with open(reportFilePath, "w") as reportFile:
                             reportFile.write(f"The full path of the monitored directory is {dirPath}\n")
-                            reportFile.write(f"The full path of the verification file is {verFilePath}.csv\n")
+                            reportFile.write(f"The full path of the verification file is {baseline.path}\n")
                             reportFile.write(f"Overall, {num_dirs} directories containing a total of {num_files} files have been scanned\n")
                             reportFile.write(f"The total time spent in initialization mode is {total_time_initialization_mode} (seconds)\n")
+                            if metrics is not None:
+                                save_metrics(metrics, reportFile, args.metrics, args.metrics_json)
 
         except Exception as e:
             print(str(e) + "\n")
@@ -184,18 +2807,12 @@ to a report file specified by the user.'
         
         print("Starting verification mode...")
         dirPath = args.directory
-        verFilePath = args.verification_file + ".csv"
         reportFilePath = args.report_file   
         hashFun = ""
 
-        # retrieves the 7th element of the first row of the csv file, which contains the name of the 
-        # hash function (inside brackets)
-        with open(verFilePath, "r") as f:
-            temp_reader = csv.reader(f)
-            hashFun = next(temp_reader)[6]
-            hashFun = hashFun[hashFun.find("(") + 1 : hashFun.find(")")]
-
         try:
+            baseline = open_baseline(args.verification_file, args.baseline_format)
+            verFilePath = baseline.path
             if args.hash_function is not None:
                 raise Exception("In verification mode the hash function cannot be specified")
             elif not os.path.isdir(dirPath):
@@ -211,115 +2828,70 @@ to a report file specified by the user.'
             elif check_if_file_is_inside_folder(reportFilePath, dirPath): # if true, file location is inside
                 raise Exception(f"The report file specified by {reportFilePath} cannot be inside the folder {dirPath}")
             else:
-                # create a new csv file that is going to be compared with the old one to see if something has changed
-                with open("new_csv_file.csv", "w", newline="") as new_csv_file:
-                    new_writer = csv.writer(new_csv_file)
-                    new_writer.writerow(['Name', 'Size (B)', 'Owner', 'Group', 'Permission levels', 'Last modification date time', 'Hash ('+hashFun+')', 'Path'])
-                    num_files, num_dirs = scan_folder(dirPath, new_writer)
-                #------------ Check if something has been deleted ------------ 
-                # from the old csv file remove all the entries that are in the new csv.
-                # If there's something left in the old csv, then it means that it was deleted
-                #
-                # Import the paths from the original csv
-                original_csv_files = set()
-                with open(verFilePath, "r") as original_csv:
-                    reader = csv.reader(original_csv)
-                    for row in reader:
-                        original_csv_files.add(row[-1])
-                # Import the paths from the new csv
-                new_csv_files = set()
-                with open("new_csv_file.csv", "r") as temp:
-                    reader = csv.reader(temp)
-                    for row in reader:
-                        new_csv_files.add(row[-1]) 
-                deleted_paths = set()
-                deleted_paths = original_csv_files - new_csv_files
-                print("------------ Scanning for deleted files or directories ------------")
-                if bool(deleted_paths): # if the set is not empty, it means that something has been deleted afterwards
-                    print("Warning: the following file/s or directory/ies has/have been deleted!")
-                    for index, deleted_file in enumerate(sorted(deleted_paths)):
-                        print(f"{index+1} - {deleted_file}")
-                else:
-                    print("Nothing was deleted!")
-                #------------ Check if something new was added ------------
-                # This is achieved by doing the opposite set subtraction from above
-                # From the new files remove all the old files. If there's something left, then it was added afterward
-                print("------------ Scanning for new files or directories ------------")
-                new_paths = new_csv_files - original_csv_files
-                if bool(new_paths):
-                    print("Warning: the following file/s or directory/ies has/have been added")
-                    for index, added_file in enumerate(sorted(new_paths)):
-                        print(f"{index+1} - {added_file}")
-                else:
-                    print("Nothing was added!")
-                #------------ Look for all the remaing stuff to find ------------
-                # 1) take the original verification file and create a new one withoout the deleted items
-                # 2) take the second verification file and create a new one without the added items
-                # 3) The resulting csv files will have the same amount of rows, thus making it possible to scan them "in parallel".
-                #    Furthermore, given the fact that they were created using the same function, the order of the item is the same.
-                
-                # 1)
-                filesInfoBefore = copy_csv_and_remove_unwanted_lines(inputCsvFile=verFilePath, outputCsvFile="ver_file_copy.csv", unwantedItems=deleted_paths)
-                
-                # 2)
-                filesInfoAfter = copy_csv_and_remove_unwanted_lines(inputCsvFile="new_csv_file.csv", outputCsvFile="second_ver_file_copy.csv", unwantedItems=new_paths)
-
-                # 3)
-                print("------------ Scanning for details ------------")
-                with open(filesInfoBefore.name, 'r') as fileA, open(filesInfoAfter.name, 'r') as fileB:
-                    readerA = csv.reader(fileA)
-                    readerB = csv.reader(fileB)
-                    
-                    list_of_changes = []
-                    # scans both copied csv files in parallel
-                    for rowA, rowB in zip(readerA, readerB):
-                        flag = False
-                        changes = {"Path" : rowA[-1],
-                               "Size" : None, 
-                               "Owner" : None, 
-                               "Group" : None, 
-                               "Permission Levels" : None, 
-                               "Last Modification Date" : None, 
-                               "Hash" : None,
-                               }
-                        
-                        if rowA[1] != rowB[1]:
-                            changes["size"] = [rowA[1], rowB[1]]
-                            flag = True
-                        if rowA[2] != rowB[2]:
-                            changes["Owner"] = [rowA[2], rowB[2]]
-                            flag = True
-                        if rowA[3] != rowB[3]:
-                            changes["Group"] = [rowA[3], rowB[3]]
-                            flag = True
-                        if rowA[4] != rowB[4]:
-                            changes["Permission Levels"] = [rowA[4], rowB[4]]
-                            flag = True
-                        if rowA[5] != rowB[5]:
-                            changes["Last Modification Date"] = [rowA[5], rowB[5]]
-                            flag = True
-                        if rowA[6] != rowB[6]:
-                            changes["Hash"] = [rowA[6], rowB[6]]
-                            flag = True
-                            
-                        
-                        if flag: # If something has changed, print it
-                            list_of_changes.append(changes)
-                
-                if list_of_changes:
-                    for index, changes in enumerate(list_of_changes):
-                        file_path = changes["Path"]
-                        print(f"{index+1} - The file/folder {file_path} has undergone the following modifications:")
-                        for key, item in changes.items():
-                            if item is not None and key != "Path":
-                                print(f"\t{key}:\t|{item[0]}| --> |{item[1]}|")
-                else:
-                    print("No file or directory was modified!") 
-
-                # When everything is done, clean up all the csv files left behind
-                os.remove("new_csv_file.csv")
-                os.remove("second_ver_file_copy.csv")
-                os.remove("ver_file_copy.csv")
+                # the hash function, the symbolic link policy and the filters come from the verification file,
+                # which is read row by row (a single run doesn't need to keep it in memory)
+                verifier = Verifier(args.verification_file, args.baseline_format, args.jobs, args.processes,
+                                    args.chunk_size, args.walkers, cache_baseline=False, trust_prefix=args.trust_appended_prefix)
+                hashFun = verifier.hash_name
+                if args.trust_appended_prefix:
+                    if verifier.scanner.block_size is None:
+                        raise Exception("--trust-appended-prefix needs a verification file hashed in blocks (see --block-size)")
+                    print("The files that have grown are only hashed from their old end on (--trust-appended-prefix)")
+                # walk the directory and compare it, row by row, with the verification file. Both are sorted
+                # in the same way, so a single pass over each of them is enough (merge-join)
+                print("------------ Comparing the directory with the verification file ------------")
+                baseline_reader = verifier.reader(dirPath)
+                # fast verification: trust the old digest of the files whose fingerprint didn't change.
+                # The lookups follow the walk, which is ahead of the comparison, so they need a reader of their own
+                fingerprints = None
+                if args.fast_verify and not args.paranoid:
+                    fingerprints = verifier.fingerprints(dirPath)
+                schedule = None
+                if args.scheduled:
+                    # scheduled verification: only the selected shards are re-hashed, the rest is checked like -F
+                    schedule = VerificationSchedule(args.schedule_state or verFilePath + ".schedule.json", args.shards,
+                                                    args.rotation_period * 24 * 3600)
+                    if schedule.shard_bytes is None:
+                        schedule.shard_bytes = baseline_shard_bytes(baseline.rows(), dirPath, args.shards)
+                    byte_budget = float("inf") if args.byte_budget is None else args.byte_budget
+                    if args.time_budget is not None:
+                        byte_budget = min(byte_budget, args.time_budget * (schedule.throughput or DEFAULT_THROUGHPUT))
+                    schedule_start = time.time()
+                    selected = schedule.select(byte_budget, schedule_start)
+                    num_overdue = sum(schedule.age(shard, schedule_start) >= schedule.rotation_period for shard in selected)
+                    fingerprints = ScheduledFingerprints(verifier.fingerprints(dirPath), dirPath, args.shards, selected)
+                # the changes are also streamed to the JSON Lines report, if one is asked for
+                report = None
+                if args.json_report:
+                    report = ChangeReport(args.json_report, mode="verification", directory=dirPath,
+                                          verification_file=verFilePath, hash_function=hashFun,
+                                          trust_appended_prefix=args.trust_appended_prefix)
+                stopped_early = False
+                try:
+                    if schedule is None:
+                        comparator = VerificationComparator(baseline_reader, report, args.max_warnings, verifier.scanner.block_size)
+                    else:
+                        comparator = ScheduledComparator(baseline_reader, args.shards, selected, report, args.max_warnings,
+                                                         verifier.scanner.block_size)
+                    try:
+                        num_files, num_dirs, num_trusted = verifier.compare(dirPath, comparator, fingerprints, metrics)
+                    except WarningLimitReached as e:
+                        print(e)
+                        stopped_early = True
+                    if report is not None:
+                        report.end(comparator, stopped_early)
+                finally:
+                    baseline_reader.close()
+                    if fingerprints is not None:
+                        fingerprints.close()
+                    if report is not None:
+                        report.close()
+                    verifier.close()
+                print(f"{comparator.num_deleted} deleted, {comparator.num_added} added and {comparator.num_modified} modified files/folders")
+                # a run stopped by --max-warnings hasn't looked at every shard, so the schedule is left as it was
+                if schedule is not None and not stopped_early:
+                    schedule.update(selected, comparator.shard_bytes, comparator.bytes_hashed, time.time() - schedule_start,
+                                    schedule_start)
 
                 # Stop counting time
                 end_time = time.time()
@@ -330,10 +2902,187 @@ to a report file specified by the user.'
                     rf.write(f"The full path of the monitored directory is {dirPath}\n")
                     rf.write(f"The full path of the verification file is {verFilePath}\n")
                     rf.write(f"The full path of this report file is {reportFilePath}\n")
-                    rf.write(f"Overall, {num_dirs} directories containing a total of {num_files} files have been scanned\n")
-                    rf.write(f"Overall, {len(deleted_paths) + len(new_paths) + len(list_of_changes)} warnings have been issued\n")
+                    if stopped_early:
+                        rf.write(f"The verification has been stopped after {comparator.num_warnings} warnings (--max-warnings), "
+                                 f"so only part of the directory has been scanned\n")
+                    else:
+                        rf.write(f"Overall, {num_dirs} directories containing a total of {num_files} files have been scanned\n")
+                    rf.write(f"Overall, {comparator.num_warnings} warnings have been issued\n")
+                    if fingerprints is not None and not stopped_early:
+                        rf.write(f"Fast verification: {num_trusted} files have been trusted and {num_files - num_trusted} files have been re-hashed\n")
+                    if args.trust_appended_prefix:
+                        rf.write("The files that have grown have only been hashed from their old end on (--trust-appended-prefix): "
+                                 "their digests assume that the rest of them hasn't been modified\n")
+                    if args.json_report:
+                        rf.write(f"Every change has been written to {args.json_report}\n")
+                    if schedule is not None and not stopped_early:
+                        rf.write(f"Scheduled verification: {len(selected)} of {args.shards} shards have been re-hashed "
+                                 f"({comparator.files_hashed} files, {comparator.bytes_hashed} bytes), {num_overdue} of them because "
+                                 f"they were older than the rotation period\n")
+                        oldest = max(schedule.age(shard, end_time) for shard in range(args.shards))
+                        rf.write(f"Coverage: {100 * schedule.coverage(end_time):.1f}% of the bytes have been re-hashed within the "
+                                 f"rotation period of {args.rotation_period} days, the least recently re-hashed shard is "
+                                 f"{oldest / 3600:.1f} hours old\n")
+                        rf.write(f"The next scheduled run starts from shard {schedule.cursor}, the state is kept in {schedule.path}\n")
                     rf.write(f"The total time spent in verification mode is {total_time_verification_mode} (seconds)\n")
+                    if metrics is not None:
+                        save_metrics(metrics, rf, args.metrics, args.metrics_json)
                
         except Exception as e:
             print("\n" + str(e) + "\n")
             traceback.print_exc()
+
+    #------------ Start of watch mode ------------
+    elif args.watch_mode:
+        print("Starting watch mode...")
+        dirPath = args.directory
+        reportFilePath = args.report_file
+        hashFun = ""
+
+        try:
+            baseline = open_baseline(args.verification_file, args.baseline_format)
+            verFilePath = baseline.path
+            if args.hash_function is not None:
+                raise Exception("In watch mode the hash function cannot be specified")
+            elif not os.path.isdir(dirPath):
+                raise NotADirectoryError(f"\n\"{dirPath}\" is not a directory")
+            elif not os.path.isfile(verFilePath):
+                raise FileNotFoundError(f"\n {verFilePath} doesn't exist")
+            elif not str(reportFilePath).endswith(".txt"):
+                raise ValueError(f"\n {reportFilePath} must be a .txt file")
+            elif check_if_file_is_inside_folder(verFilePath, dirPath): # if true, file location is inside
+                raise Exception(f"The verification file specified by {verFilePath} cannot be inside the root folder {dirPath}")
+            elif check_if_file_is_inside_folder(reportFilePath, dirPath): # if true, file location is inside
+                raise Exception(f"The report file specified by {reportFilePath} cannot be inside the folder {dirPath}")
+            else:
+                hashFun = baseline.read_hash_name()
+                symlinks, walk_filter = baseline_walk(baseline, dirPath)
+                block_size = (baseline.read_walk_options() or {}).get("block_size")
+                watcher = Watcher(dirPath, baseline, hashFun, reportFilePath, args.jobs, args.processes, args.chunk_size,
+                                  args.paranoid, args.fast_verify, args.debounce, args.checkpoint_interval,
+                                  args.rescan_interval, walk_filter, block_size, symlinks)
+                watcher.run(args.watch_duration)
+
+        except Exception as e:
+            print("\n" + str(e) + "\n")
+            traceback.print_exc()
+
+    #------------ Start of conversion mode ------------
+    elif args.convert_mode:
+        print("Starting conversion mode...")
+        try:
+            source = open_baseline(args.verification_file, "csv")
+            destination = open_baseline(args.verification_file, args.baseline_format or "sqlite")
+            if not os.path.isfile(source.path):
+                raise FileNotFoundError(f"\n {source.path} doesn't exist")
+            elif destination.path == source.path:
+                raise Exception("The verification file is already a CSV file")
+            else:
+                num_rows = convert_baseline(source, destination)
+                print(f"{num_rows} rows have been copied from {source.path} to {destination.path}")
+
+        except Exception as e:
+            print("\n" + str(e) + "\n")
+            traceback.print_exc()
+
+    #------------ Start of tree comparison mode ------------
+    elif args.tree_compare_mode:
+        start_time = time.time()
+        print("Starting tree comparison mode...")
+        reportFilePath = args.report_file
+        hashFun = ""
+
+        try:
+            baseline = open_baseline(args.verification_file, args.baseline_format)
+            verFilePath = baseline.path
+            if not os.path.isfile(verFilePath):
+                raise FileNotFoundError(f"\n {verFilePath} doesn't exist")
+            elif not str(reportFilePath).endswith(".txt"):
+                raise ValueError(f"\n {reportFilePath} must be a .txt file")
+            elif args.against is None and not os.path.isdir(args.directory):
+                raise NotADirectoryError(f"\n\"{args.directory}\" is not a directory")
+            else:
+                hashFun = baseline.read_hash_name()
+                with tempfile.TemporaryDirectory() as snapshot_dir:
+                    if args.against is not None:
+                        name, extension = os.path.splitext(args.against)
+                        formats = [f for f, backend in BASELINE_FORMATS.items() if backend.extension == extension]
+                        newer = open_baseline(name, formats[0]) if formats else open_baseline(args.against)
+                        if not os.path.isfile(newer.path):
+                            raise FileNotFoundError(f"\n {newer.path} doesn't exist")
+                    else:
+                        # fast snapshot of the directory: only the files whose fingerprint changed are hashed
+                        print("------------ Taking a snapshot of the directory ------------")
+                        newer = SqliteBaseline(os.path.join(snapshot_dir, "snapshot" + SqliteBaseline.extension))
+                        verifier = Verifier(args.verification_file, args.baseline_format, args.jobs, args.processes,
+                                            args.chunk_size, cache_baseline=False)
+                        fingerprints = None if args.paranoid else verifier.fingerprints(args.directory)
+                        writer = newer.create(hashFun, walk_options=verifier.scanner.walk_options)
+                        try:
+                            tree_builder = MerkleBuilder(writer, args.directory, hashFun)
+                            verifier.scanner.write(args.directory, tree_builder, fingerprints, resolve_names=False,
+                                                   metrics=metrics)
+                            tree_builder.close()
+                        finally:
+                            writer.close()
+                            if fingerprints is not None:
+                                fingerprints.close()
+                            verifier.close()
+                    if newer.read_hash_name() != hashFun:
+                        raise Exception(f"{verFilePath} and {newer.path} have been computed with different hash functions")
+                    print("------------ Comparing the directory digests ------------")
+                    old_index, new_index = baseline.tree_index(), newer.tree_index()
+                    report = None
+                    stopped_early = False
+                    try:
+                        for index, path in ((old_index, verFilePath), (new_index, newer.path)):
+                            if index.root_folder is None:
+                                raise Exception(f"{path} has no directory digests, create it again with -i")
+                        if args.json_report:
+                            report = ChangeReport(args.json_report, mode="tree comparison", verification_file=verFilePath,
+                                                  against=args.against and newer.path, directory=args.directory,
+                                                  hash_function=hashFun)
+                        # both verification files must have been hashed in blocks of the same size to compare the blocks
+                        block_sizes = {(b.read_walk_options() or {}).get("block_size") for b in (baseline, newer)}
+                        comparator = VerificationComparator(None, report, args.max_warnings,
+                                                            block_sizes.pop() if len(block_sizes) == 1 else None)
+                        try:
+                            num_descended, num_skipped = compare_trees(old_index, new_index, comparator)
+                        except WarningLimitReached as e:
+                            print(e)
+                            stopped_early = True
+                        if report is not None:
+                            report.end(comparator, stopped_early)
+                    finally:
+                        old_index.close()
+                        new_index.close()
+                        if report is not None:
+                            report.close()
+                print(f"{comparator.num_deleted} deleted, {comparator.num_added} added and {comparator.num_modified} modified files/folders")
+                end_time = time.time()
+
+                with open(reportFilePath, "w") as rf:
+                    rf.write(f"The full path of the verification file is {verFilePath}\n")
+                    if args.against is not None:
+                        rf.write(f"The full path of the verification file it has been compared with is {newer.path}\n")
+                    else:
+                        rf.write(f"The full path of the monitored directory is {args.directory}\n")
+                    rf.write(f"The full path of this report file is {reportFilePath}\n")
+                    if stopped_early:
+                        rf.write(f"The comparison has been stopped after {comparator.num_warnings} warnings (--max-warnings)\n")
+                    else:
+                        rf.write(f"Overall, {num_descended} directories have been compared and {num_skipped} unchanged subtrees have been skipped\n")
+                    rf.write(f"Overall, {comparator.num_warnings} warnings have been issued\n")
+                    if args.json_report:
+                        rf.write(f"Every change has been written to {args.json_report}\n")
+                    rf.write(f"The total time spent in tree comparison mode is {end_time - start_time} (seconds)\n")
+                    if metrics is not None:
+                        save_metrics(metrics, rf, args.metrics, args.metrics_json)
+
+        except Exception as e:
+            print("\n" + str(e) + "\n")
+            traceback.print_exc()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
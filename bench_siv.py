@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Benchmark suite for the System Integrity Verifier (SIV)
+#
+# It generates a reproducible synthetic tree in a temporary directory, runs SIV in
+# initialization mode, applies a controlled percentage of mutations (modified, deleted,
+# added and chmod-ed files) and runs SIV in verification mode. For every run it records
+# the wall time, files/s, MB/s, peak RSS and, if strace is installed and --syscalls is
+# given, the number of syscalls. The results are written as JSON, so that two commits
+# can be compared with --compare.
+#
+#   ./bench_siv.py -n 100000 --depth 4 --fanout 8 -m 0,1,10 -o before.json
+#   ./bench_siv.py -n 100000 --depth 4 --fanout 8 -m 0,1,10 -o after.json --fast -a "-j 4"
+#   ./bench_siv.py --compare before.json after.json
+import os
+import sys
+import json
+import math
+import random
+import shlex
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import time
+
+SIV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SIV.py")
+
+def file_sizes(rng, count, distribution, mean_size, max_size):
+    '''Returns count file sizes drawn from the given distribution (fixed, uniform or lognormal)'''
+    if distribution == "fixed":
+        return [mean_size] * count
+    if distribution == "uniform":
+        return [rng.randint(0, 2 * mean_size) for _ in range(count)]
+    # lognormal with the requested mean: most files are small, a few are large
+    sigma = 1.5
+    mu = math.log(max(mean_size, 1)) - sigma * sigma / 2
+    return [min(int(rng.lognormvariate(mu, sigma)), max_size) for _ in range(count)]
+
+def make_dirs(root, depth, fanout):
+    '''Creates a tree of directories with the given depth and fan-out and returns all of them (root included)'''
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                path = os.path.join(parent, f"d{i:03d}")
+                os.mkdir(path)
+                next_level.append(path)
+        dirs.extend(next_level)
+        level = next_level
+    return dirs
+
+def populate_tree(root, args):
+    '''Generates the synthetic tree described by args in root; the same seed always gives the same tree.
+    It returns the list of (path, size) of the files that have been created'''
+    rng = random.Random(args.seed)
+    os.makedirs(root)
+    dirs = make_dirs(root, args.depth, args.fanout)
+    files = []
+    for i, size in enumerate(file_sizes(rng, args.files, args.size_distribution, args.mean_size, args.max_size)):
+        path = os.path.join(rng.choice(dirs), f"f{i:07d}")
+        with open(path, "wb") as fh:
+            fh.write(rng.randbytes(size))
+        files.append((path, size))
+    return files
+
+def mutate_tree(files, percentage, seed):
+    '''Modifies, deletes, chmods and adds (each) percentage% of the files. Returns the number of mutations'''
+    rng = random.Random(seed + 1)
+    count = int(len(files) * percentage / 100)
+    if count == 0:
+        return 0
+    sample = rng.sample(files, min(len(files), 3 * count))
+    modified, deleted, chmoded = sample[:count], sample[count:2 * count], sample[2 * count:]
+    for path, _ in modified:
+        with open(path, "ab") as fh:
+            fh.write(b"mutation")
+    for path, _ in deleted:
+        os.remove(path)
+    for path, _ in chmoded:
+        os.chmod(path, 0o600)
+    for i in range(count):
+        path, _ = rng.choice(files)
+        with open(os.path.join(os.path.dirname(path), f"new{i:07d}"), "wb") as fh:
+            fh.write(rng.randbytes(1024))
+    return len(modified) + len(deleted) + len(chmoded) + count
+
+def run_siv(siv_args, report_path, syscalls):
+    '''Runs SIV with siv_args and returns (wall time in seconds, peak RSS in KiB, number of syscalls or None).
+    SIV prints its errors and exits with 0, so a run only counts if it has written its report file (report_path)
+    up to the total time'''
+    cmd = [sys.executable, SIV_PATH] + siv_args
+    if os.path.exists(report_path): # left by a previous run
+        os.remove(report_path)
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed with exit code {process.returncode}")
+    if not report_finished(report_path):
+        raise RuntimeError(f"{' '.join(cmd)} failed: it didn't write the report file {report_path}")
+    num_syscalls = None
+    if syscalls:
+        # counting syscalls slows the process down, so it is done in a separate run
+        with tempfile.NamedTemporaryFile("r", suffix=".strace") as summary:
+            subprocess.run(["strace", "-f", "-c", "-o", summary.name] + cmd, stdout=subprocess.DEVNULL, check=True)
+            for line in summary:
+                fields = line.split()
+                if fields and fields[-1] == "total":
+                    num_syscalls = int(fields[3])
+    return wall, rusage.ru_maxrss, num_syscalls
+
+def report_finished(report_path):
+    '''Returns True if report_path is the report file of a run that has completed'''
+    try:
+        with open(report_path) as fh:
+            return any(line.startswith("The total time spent in") for line in fh)
+    except FileNotFoundError:
+        return False
+
+def record(results, mode, mutation, siv_args, files, total_bytes, syscalls):
+    wall, rss, num_syscalls = run_siv(siv_args, siv_args[siv_args.index("-R") + 1], syscalls)
+    result = {
+        "mode": mode,
+        "mutation_percentage": mutation,
+        "wall_time_s": wall,
+        "files": files,
+        "bytes": total_bytes,
+        "files_per_s": files / wall,
+        "mb_per_s": total_bytes / (1000 * 1000) / wall,
+        "peak_rss_kb": rss,
+        "syscalls": num_syscalls,
+    }
+    results.append(result)
+    print(f"{mode:>12} {mutation:>6}% {wall:>9.3f}s {result['files_per_s']:>11.0f} files/s "
+          f"{result['mb_per_s']:>9.1f} MB/s {rss:>9} KiB" + ("" if num_syscalls is None else f" {num_syscalls} syscalls"))
+
+def git_commit():
+    '''Returns the commit of the SIV checkout, if it is a git repository'''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(SIV_PATH), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(args):
+    syscalls = args.syscalls and shutil.which("strace") is not None
+    if args.syscalls and not syscalls:
+        print("strace is not installed, syscalls won't be counted")
+    extra = shlex.split(args.siv_args)
+    results = []
+    for mutation in [float(m) for m in args.mutations.split(",")]:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            data = os.path.join(tmp, "data")
+            files = populate_tree(data, args)
+            total_bytes = sum(size for _, size in files)
+            common = ["-D", data, "-V", os.path.join(tmp, "vDB")] + extra
+            record(results, "init", mutation, ["-i", "-R", os.path.join(tmp, "init.txt"), "-H", args.hash_function] + common,
+                   len(files), total_bytes, syscalls)
+            mutate_tree(files, mutation, args.seed)
+            record(results, "verify", mutation, ["-v", "-R", os.path.join(tmp, "verify.txt")] + common,
+                   len(files), total_bytes, syscalls)
+            if args.fast:
+                record(results, "fast-verify", mutation, ["-v", "-F", "-R", os.path.join(tmp, "verify.txt")] + common,
+                       len(files), total_bytes, syscalls)
+    output = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "results": results,
+    }
+    with open(args.output, "w") as fh:
+        json.dump(output, fh, indent=2)
+    print(f"Results written to {args.output}")
+
+def compare(old_path, new_path):
+    '''Prints the ratio between the results of two benchmark runs (new / old)'''
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+    print(f"{old_path} ({old['commit']}) --> {new_path} ({new['commit']})")
+    old_results = {(r["mode"], r["mutation_percentage"]): r for r in old["results"]}
+    for result in new["results"]:
+        before = old_results.get((result["mode"], result["mutation_percentage"]))
+        if before is None:
+            continue
+        line = (f"{result['mode']:>12} {result['mutation_percentage']:>6}% "
+                f"time {before['wall_time_s']:.3f}s --> {result['wall_time_s']:.3f}s "
+                f"(speedup {before['wall_time_s'] / result['wall_time_s']:.2f}x), "
+                f"RSS {before['peak_rss_kb']} --> {result['peak_rss_kb']} KiB")
+        if before["syscalls"] and result["syscalls"]:
+            line += f", syscalls {before['syscalls']} --> {result['syscalls']}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type=int, default=10000, help="Number of files of the synthetic tree")
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the directory tree")
+    parser.add_argument("--fanout", type=int, default=4, help="Number of subdirectories of every directory")
+    parser.add_argument("--size-distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--mean-size", type=int, default=16 * 1024, help="Mean file size in bytes")
+    parser.add_argument("--max-size", type=int, default=64 * 1024 * 1024, help="Largest file size in bytes")
+    parser.add_argument("--seed", type=int, default=2595, help="Seed of the generator (same seed, same tree)")
+    parser.add_argument("-m", "--mutations", type=str, default="0,1",
+                        help="Comma separated percentages of files to mutate before each verification")
+    parser.add_argument("-H", "--hash-function", type=str, default="sha1")
+    parser.add_argument("-a", "--siv-args", type=str, default="", help="Extra arguments for SIV (e.g. \"-j 4\")")
+    parser.add_argument("--fast", action="store_true", help="Also run the fast verification (-F)")
+    parser.add_argument("--syscalls", action="store_true", help="Count the syscalls with strace (extra run)")
+    parser.add_argument("-d", "--dir", type=str, default=None, help="Directory for the synthetic trees")
+    parser.add_argument("-o", "--output", type=str, default="bench_output.json", help="JSON file for the results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two JSON result files")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
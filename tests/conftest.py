@@ -0,0 +1,38 @@
+# Shared fixtures of the SIV tests, run with: python -m pytest tests
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIV_PATH = os.path.join(REPO, "SIV.py")
+sys.path.insert(0, REPO)
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+@pytest.fixture
+def tree(tmp_path):
+    '''A small directory tree, with enough subdirectories for the walker processes to share it'''
+    root = tmp_path / "tree"
+    for d in range(6):
+        for f in range(5):
+            write_file(str(root / f"dir{d}" / f"sub{f % 2}" / f"file{f}.txt"), f"{d}-{f}\n".encode() * (f + 1))
+    write_file(str(root / "top.txt"), b"top\n")
+    os.makedirs(root / "empty")
+    return str(root)
+
+@pytest.fixture
+def initialize(tmp_path, tree):
+    '''Runs the initialization of tree from the command line, like a user would, into the verification file
+    tmp_path/name with the extra args. A launcher (the start of the command that runs SIV_PATH) can be given.
+    Returns the path of the verification file and the subprocess.CompletedProcess'''
+    def run(name, *args, launcher=(sys.executable,)):
+        verification_file = str(tmp_path / name)
+        command = [*launcher, SIV_PATH, "-i", "-D", tree, "-V", verification_file, "-R", str(tmp_path / f"{name}.txt"),
+                   "-H", "sha256", *args]
+        return verification_file + ".csv", subprocess.run(command, capture_output=True, text=True)
+    return run
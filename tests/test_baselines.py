@@ -0,0 +1,18 @@
+# Tests of the verification file formats
+import os
+
+import SIV
+
+def verify(verification_file, root):
+    with SIV.Verifier(verification_file) as verifier:
+        changes = list(verifier.verify(root))
+    return changes
+
+def test_sqlite_path_with_uri_characters(tmp_path, tree):
+    directory = tmp_path / "q#dir" / "a%20b?c"
+    directory.mkdir(parents=True)
+    verification_file = str(directory / "v")
+    with SIV.Scanner() as scanner:
+        scanner.create(tree, verification_file, "sqlite")
+    assert verify(verification_file, tree) == []
+    assert sorted(os.listdir(tmp_path)) == ["q#dir", "tree"] # no stray database
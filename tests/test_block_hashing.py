@@ -0,0 +1,39 @@
+# Tests of the files hashed in blocks (--block-size)
+import os
+import time
+
+import SIV
+
+BLOCK_SIZE = 64 * 1024
+
+def edit_and_append(path):
+    '''Overwrites the first bytes of a file and appends to it, keeping its inode'''
+    time.sleep(0.01) # so that the ctime and mtime change
+    with open(path, "r+b") as f:
+        f.write(b"XXXX")
+        f.seek(0, os.SEEK_END)
+        f.write(b"YYYY")
+
+def verify(verification_file, root, **settings):
+    with SIV.Verifier(verification_file, **settings) as verifier:
+        return list(verifier.verify(root))
+
+def test_fast_verification_rehashes_grown_files(tmp_path):
+    root = tmp_path / "tree"
+    root.mkdir()
+    path = root / "data"
+    path.write_bytes(os.urandom(300000))
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner(block_size=BLOCK_SIZE) as scanner:
+        scanner.create(str(root), verification_file)
+    edit_and_append(str(path))
+
+    full = verify(verification_file, str(root))
+    fast = verify(verification_file, str(root), fast=True)
+    assert fast == full
+    assert full[0]["changed_ranges"] == [[0, BLOCK_SIZE], [4 * BLOCK_SIZE, 300004]]
+
+    # trusting the prefix only reads the last block on, so the edit at the start goes unnoticed
+    trusted = verify(verification_file, str(root), fast=True, trust_prefix=True)
+    assert trusted[0]["changed_ranges"] == [[4 * BLOCK_SIZE, 300004]]
+    assert trusted[0]["after"]["hash"] != full[0]["after"]["hash"]
@@ -0,0 +1,54 @@
+# Tests of the JSON Lines change report (--json-report)
+import json
+import os
+import subprocess
+import sys
+
+import SIV
+
+FIELDS = {"size", "owner", "group", "permissions", "mtime", "hash"}
+
+def verify(tmp_path, tree, verification_file, *args):
+    report = tmp_path / "changes.jsonl"
+    subprocess.run([sys.executable, SIV.__file__, "-v", "-D", tree, "-V", verification_file,
+                    "-R", str(tmp_path / "report.txt"), "--json-report", str(report), *args], check=True,
+                   capture_output=True)
+    return [json.loads(line) for line in report.read_text().splitlines()]
+
+def test_change_report_schema(tmp_path, tree):
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner() as scanner:
+        scanner.create(tree, verification_file)
+    modified = os.path.join(tree, "dir0", "sub0", "file0.txt")
+    with open(modified, "a") as f:
+        f.write("changed\n")
+    os.utime(modified, (1_000_000_000, 1_000_000_000))
+    chmoded = os.path.join(tree, "dir1", "sub1", "file1.txt")
+    permissions = oct(os.stat(chmoded).st_mode & 0o777)
+    os.chmod(chmoded, 0o400)
+    os.remove(os.path.join(tree, "dir2", "sub0", "file2.txt"))
+    with open(os.path.join(tree, "dir3", "new.txt"), "w") as f:
+        f.write("new\n")
+
+    records = verify(tmp_path, tree, verification_file)
+    start, changes, end = records[0], records[1:-1], records[-1]
+    assert start == {"event": "start", "schema": 1, "mode": "verification", "directory": tree,
+                     "verification_file": verification_file + ".csv", "hash_function": "sha1",
+                     "trust_appended_prefix": False}
+    by_path = {os.path.relpath(change["path"], tree): change for change in changes}
+    assert [change["event"] for change in changes] == ["modified", "modified", "deleted", "added"]
+
+    content = by_path["dir0/sub0/file0.txt"]
+    assert set(content["before"]) == set(content["after"]) == {"size", "mtime", "hash"}
+    assert isinstance(content["before"]["size"], int) and content["after"]["size"] == content["before"]["size"] + 8
+    assert content["changed_ranges"] is None # not hashed in blocks
+    assert by_path["dir1/sub1/file1.txt"]["before"] == {"permissions": permissions}
+    assert by_path["dir1/sub1/file1.txt"]["after"] == {"permissions": "0o400"}
+    deleted, added = by_path["dir2/sub0/file2.txt"], by_path["dir3/new.txt"]
+    assert deleted["after"] is None and set(deleted["before"]) == FIELDS
+    assert added["before"] is None and set(added["after"]) == FIELDS
+    assert end == {"event": "end", "deleted": 1, "added": 1, "modified": 2, "stopped_early": False}
+
+    records = verify(tmp_path, tree, verification_file, "--max-warnings", "2")
+    assert len(records) == 4
+    assert records[-1] == {"event": "end", "deleted": 0, "added": 0, "modified": 2, "stopped_early": True}
@@ -0,0 +1,34 @@
+# Tests of the include/exclude filters of the walk
+import csv
+import os
+
+import SIV
+
+def verify(verification_file, root):
+    with SIV.Verifier(verification_file) as verifier:
+        return [(change["event"], os.path.relpath(change["path"], root)) for change in verifier.verify(root)]
+
+def write(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+def test_filters_are_round_tripped(tmp_path, tree):
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner(exclude=["dir1"], include=["*.txt"], exclude_regex=["sub1/file3"], max_depth=3) as scanner:
+        scanner.create(tree, verification_file)
+    baseline = SIV.open_baseline(verification_file)
+    options = baseline.read_walk_options()
+    assert options["exclude"] == ["dir1"]
+    assert options["include"] == ["*.txt"]
+    assert options["exclude_regex"] == ["sub1/file3"]
+    assert options["max_depth"] == 3
+    with open(baseline.path) as f:
+        paths = [os.path.relpath(row[SIV.PATH_COLUMN], tree) for row in csv.reader(f) if len(row) > SIV.PATH_COLUMN]
+    assert not [path for path in paths if path.startswith("dir1") or path.endswith("sub1/file3.txt")]
+    # the verification walks the tree with the same filters: what they leave out isn't reported
+    write(os.path.join(tree, "dir1", "sub0", "file0.txt"), "changed\n")
+    write(os.path.join(tree, "dir0", "sub1", "file3.txt"), "changed\n")
+    write(os.path.join(tree, "dir0", "notes.md"), "not included\n")
+    assert verify(verification_file, tree) == []
+    write(os.path.join(tree, "dir0", "sub1", "file1.txt"), "changed\n")
+    assert verify(verification_file, tree) == [("modified", "dir0/sub1/file1.txt")]
@@ -0,0 +1,26 @@
+# Tests of the file hashing
+import hashlib
+import os
+
+import SIV
+
+def test_file_truncated_while_hashed(tmp_path):
+    '''A large file that shrinks while it is hashed gives the digest of what was read, it doesn't kill the process'''
+    path = str(tmp_path / "log")
+    chunk_size = 1024 * 1024
+    data = os.urandom(100 * chunk_size)
+    with open(path, "wb") as f:
+        f.write(data)
+    sha1 = hashlib.sha1()
+
+    class TruncatingHasher:
+        '''Truncates the file (like a log rotation) after the first chunk'''
+        def update(self, chunk):
+            sha1.update(chunk)
+            os.truncate(path, 1000)
+
+        def hexdigest(self):
+            return sha1.hexdigest()
+
+    digest = SIV.hash_file(path, TruncatingHasher, chunk_size, size=len(data))
+    assert digest == hashlib.sha1(data[:chunk_size]).hexdigest()
@@ -0,0 +1,27 @@
+# Tests of the verification files written by the first versions
+import csv
+import os
+
+import SIV
+
+def verify(verification_file, root, **settings):
+    with SIV.Verifier(verification_file, **settings) as verifier:
+        return [(change["event"], os.path.relpath(change["path"], root)) for change in verifier.verify(root)]
+
+def test_legacy_csv_file_still_verifies(tmp_path, tree):
+    '''Verification files of the first versions only have the name, size, owner and group names, permissions,
+    date, hash and path columns (no fingerprint, no numeric ids), and the hash function in the header'''
+    with SIV.Scanner() as scanner:
+        rows = list(scanner.scan(tree))
+    verification_file = str(tmp_path / "legacy")
+    with open(verification_file + ".csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['Name', 'Size (B)', 'Owner', 'Group', 'Permission levels', 'Last modification date time',
+                         'Hash (sha1)', 'Path'])
+        for row in rows:
+            writer.writerow(row[:SIV.PATH_COLUMN + 1])
+    assert verify(verification_file, tree) == []
+    assert verify(verification_file, tree, fast=True) == []
+    with open(os.path.join(tree, "dir2", "sub0", "file0.txt"), "a") as f:
+        f.write("changed\n")
+    assert verify(verification_file, tree) == [("modified", "dir2/sub0/file0.txt")]
@@ -0,0 +1,34 @@
+# Tests of the metrics of a run (--metrics, --metrics-json)
+import json
+
+import SIV
+
+def test_metrics_keep_the_slowest_files():
+    metrics = SIV.Metrics(slowest=2)
+    for index, elapsed_ns in enumerate([3_000_000, 1_000_000, 5_000_000, 2_000_000]):
+        metrics.file_hashed(f"file{index}", 1_000_000, elapsed_ns)
+    metrics.add("walk", 4_000_000)
+    metrics.stop()
+    summary = metrics.to_dict()
+    assert summary["phases_s"] == {"walk": 0.004, "hash": 0.011}
+    assert summary["counts"] == {"files hashed": 4, "bytes hashed": 4_000_000}
+    assert summary["slowest_files"] == [{"path": "file2", "time_s": 0.005}, {"path": "file0", "time_s": 0.003}]
+    assert abs(summary["throughput"]["hash_mb_per_s"] - 4 / 0.011) < 1e-6
+    lines = metrics.report_lines()
+    assert lines[0] == "------------ Metrics ------------"
+    assert "Time spent in walk: 0.004000 (seconds)" in lines
+    assert "Number of files hashed: 4" in lines
+    assert lines[-2:] == ["Slowest file 1: file2 (0.005000 seconds)", "Slowest file 2: file0 (0.003000 seconds)"]
+
+def test_metrics_of_an_initialization(tmp_path, initialize):
+    json_path = tmp_path / "metrics.json"
+    _, result = initialize("v", "--metrics", "--metrics-json", str(json_path), "--slowest", "3")
+    assert result.returncode == 0, result.stderr
+    report = (tmp_path / "v.txt").read_text()
+    assert "------------ Metrics ------------" in report
+    assert "Number of files hashed: 31" in report
+    summary = json.loads(json_path.read_text())
+    assert set(summary) == {"total_time_s", "phases_s", "counts", "throughput", "slowest_files"}
+    assert {"walk", "hash", "write"} <= set(summary["phases_s"])
+    assert (summary["counts"]["files hashed"], summary["counts"]["bytes hashed"]) == (31, 364)
+    assert len(summary["slowest_files"]) == 3
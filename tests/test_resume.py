@@ -0,0 +1,58 @@
+# Tests of the resumable initialization (--resume)
+import os
+import sys
+
+import SIV
+
+# runs SIV.py (its path is the first argument) with the opening of the file given in STOP_AT interrupted, like with Ctrl+C
+INTERRUPTED_RUN = '''
+import builtins, os, runpy, sys
+stop_at = os.environ["STOP_AT"]
+real_open = builtins.open
+def interrupting_open(file, mode="r", *args, **kwargs):
+    if str(file) == stop_at:
+        raise KeyboardInterrupt
+    return real_open(file, mode, *args, **kwargs)
+builtins.open = interrupting_open
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+'''
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_resumed_initialization_is_identical(tree, initialize, monkeypatch):
+    expected, result = initialize("uninterrupted")
+    assert result.returncode == 0, result.stderr
+    monkeypatch.setenv("STOP_AT", os.path.join(tree, "dir3", "sub1", "file1.txt"))
+    resumed, result = initialize("resumed", "--save-interval", "0", launcher=(sys.executable, "-c", INTERRUPTED_RUN))
+    monkeypatch.delenv("STOP_AT")
+    assert result.returncode != 0
+    assert "--resume" in result.stdout
+    assert os.path.isfile(resumed + ".checkpoint.json")
+    _, result = initialize("resumed", "--resume")
+    assert result.returncode == 0, result.stderr
+    assert "Resuming after" in result.stdout and "Resuming after 0 files" not in result.stdout
+    assert read(resumed) == read(expected)
+    assert not os.path.exists(resumed + ".checkpoint.json")
+
+def test_progress_is_estimated_from_the_previous_verification_file(tmp_path, tree):
+    verification_file = str(tmp_path / "v")
+    baseline = SIV.open_baseline(verification_file)
+    assert SIV.estimated_tree_bytes(baseline, tree) is None
+    with SIV.Scanner() as scanner:
+        scanner.create(tree, verification_file)
+    total = sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names in os.walk(tree) for name in names)
+    assert SIV.estimated_tree_bytes(baseline, tree) == total
+    assert SIV.estimated_tree_bytes(baseline, str(tmp_path / "another tree")) is None
+
+def test_progress_without_estimate_has_no_percentage(tmp_path, capsys):
+    checkpoint = SIV.InitCheckpoint(str(tmp_path / "checkpoint.json"), None, str(tmp_path), {}, 60, True)
+    checkpoint.bytes_done = 5_000_000
+    checkpoint.show_progress(checkpoint.start + 1)
+    line = capsys.readouterr().out
+    assert "5.0 MB, 5.0 MB/s" in line and "%" not in line and "left" not in line
+    checkpoint.total_bytes = 10_000_000
+    checkpoint.show_progress(checkpoint.start + 1)
+    assert "(50.0%)" in capsys.readouterr().out
@@ -0,0 +1,64 @@
+# Tests of the scheduled verification (--scheduled)
+import json
+import subprocess
+import sys
+
+import SIV
+
+DAY = 24 * 3600
+
+def schedule(tmp_path, shard_bytes, num_shards=4, rotation_period=7 * DAY, created=0.0):
+    state = SIV.VerificationSchedule(str(tmp_path / "schedule.json"), num_shards, rotation_period)
+    state.created = created
+    state.shard_bytes = shard_bytes
+    return state
+
+def test_select_fills_the_budget_from_the_cursor(tmp_path):
+    state = schedule(tmp_path, [100, 100, 100, 100])
+    assert state.select(250, now=DAY) == [0, 1]
+    state.cursor = 3
+    assert state.select(250, now=DAY) == [3, 0] # wraps around
+    assert state.select(10, now=DAY) == [3]     # at least one shard, even over the budget
+
+def test_overdue_shards_are_selected_over_the_budget(tmp_path):
+    state = schedule(tmp_path, [100, 100, 100, 100])
+    state.last_verified = [8 * DAY, 2 * DAY, 8 * DAY, 8 * DAY]
+    # shard 1 hasn't been re-hashed for more than the rotation period
+    assert state.select(150, now=10 * DAY) == [0, 1]
+    state.last_verified = [8 * DAY, 2 * DAY, 1 * DAY, 8 * DAY]
+    assert state.select(150, now=10 * DAY) == [0, 1, 2]
+    # a schedule that has never run is overdue once it is older than the rotation period
+    assert schedule(tmp_path, [100] * 4).select(150, now=8 * DAY) == [0, 1, 2, 3]
+
+def test_update_moves_the_cursor_and_is_saved(tmp_path):
+    state = schedule(tmp_path, [100, 200, 300, 400])
+    state.update([2, 3], [100, 200, 300, 500], bytes_hashed=800, elapsed=2.0, now=5 * DAY)
+    assert state.cursor == 0 # wrapped around
+    loaded = SIV.VerificationSchedule(state.path, 4, 7 * DAY)
+    assert (loaded.cursor, loaded.last_verified, loaded.shard_bytes, loaded.throughput) == \
+           (0, [None, None, 5 * DAY, 5 * DAY], [100, 200, 300, 500], 400.0)
+    # another number of shards starts the schedule again
+    assert SIV.VerificationSchedule(state.path, 8, 7 * DAY).shard_bytes is None
+
+def test_coverage(tmp_path):
+    state = schedule(tmp_path, [100, 300, 0, 600])
+    state.last_verified = [9 * DAY, 1 * DAY, None, 5 * DAY]
+    assert state.coverage(10 * DAY) == 0.7 # shard 1 is older than the rotation period
+    assert schedule(tmp_path, [0, 0, 0, 0]).coverage(DAY) == 1.0
+
+def test_first_scheduled_run_takes_the_shard_sizes_from_the_verification_file(tmp_path, tree):
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner() as scanner:
+        scanner.create(tree, verification_file)
+    state_path = tmp_path / "schedule.json"
+    result = subprocess.run([sys.executable, SIV.__file__, "-v", "-S", "--byte-budget", "100", "--shards", "8",
+                             "--schedule-state", str(state_path), "-D", tree, "-V", verification_file,
+                             "-R", str(tmp_path / "report.txt")], capture_output=True, text=True)
+    assert "Traceback" not in result.stderr + result.stdout
+    assert "Scheduled verification:" in (tmp_path / "report.txt").read_text()
+    state = json.loads(state_path.read_text())
+    baseline = SIV.open_baseline(verification_file)
+    assert state["shard_bytes"] == SIV.baseline_shard_bytes(baseline.rows(), tree, 8)
+    verified = [shard for shard, last_verified in enumerate(state["last_verified"]) if last_verified is not None]
+    assert 1 <= len(verified) < 8 # the tree has more than 100 bytes
+    assert state["cursor"] == (verified[-1] + 1) % 8
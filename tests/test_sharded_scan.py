@@ -0,0 +1,54 @@
+# Tests of the sharded scan (--walkers)
+import csv
+import io
+import multiprocessing
+
+import pytest
+
+import SIV
+
+@pytest.fixture
+def fork():
+    '''The walker processes must be forked for them to see the monkeypatched functions'''
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("fork", force=True)
+    yield
+    multiprocessing.set_start_method(method, force=True)
+
+def scan(root, walkers):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if walkers > 1:
+        counts = SIV.scan_folder_sharded(root, writer, walkers)
+    else:
+        counts = SIV.scan_folder(root, writer)
+    return out.getvalue(), counts
+
+def test_sharded_scan_is_identical_to_serial_scan(tree):
+    serial, serial_counts = scan(tree, 1)
+    for walkers in (2, 3):
+        sharded, counts = scan(tree, walkers)
+        assert sharded == serial
+        assert counts == serial_counts
+
+def test_failing_walker_stops_the_scan(tree, monkeypatch, fork):
+    hash_file = SIV.hash_file
+    def failing_hash_file(filepath, *args, **kwargs):
+        if filepath.endswith("dir3/sub1/file3.txt"):
+            raise PermissionError(13, "Permission denied", filepath)
+        return hash_file(filepath, *args, **kwargs)
+    monkeypatch.setattr(SIV, "hash_file", failing_hash_file)
+    with pytest.raises(Exception, match="PermissionError"):
+        scan(tree, 3)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_walkers_give_the_serial_verification_file(initialize):
+    expected, result = initialize("serial")
+    assert result.returncode == 0, result.stderr
+    for walkers in ("2", "4"):
+        sharded, result = initialize(f"walkers-{walkers}", "--walkers", walkers)
+        assert result.returncode == 0, result.stderr
+        assert read(sharded) == read(expected)
@@ -0,0 +1,19 @@
+# Tests of the directory digests (Merkle tree)
+import time
+
+import SIV
+
+def tree_digests(root, verification_file):
+    with SIV.Scanner() as scanner:
+        scanner.create(root, verification_file)
+    return dict(SIV.open_baseline(verification_file).tree_digests())
+
+def test_directory_digests_do_not_depend_on_the_timezone(tmp_path, tree, monkeypatch):
+    digests = []
+    for timezone in ("UTC", "Asia/Tokyo"):
+        monkeypatch.setenv("TZ", timezone)
+        time.tzset()
+        digests.append(tree_digests(tree, str(tmp_path / timezone.replace("/", "-"))))
+    monkeypatch.undo()
+    time.tzset()
+    assert digests[0] and digests[0] == digests[1]
@@ -0,0 +1,68 @@
+# Tests of verification mode (the merge-join of the walk with the verification file)
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+import SIV
+
+def create(root, verification_file, baseline_format="csv", **options):
+    with SIV.Scanner(**options) as scanner:
+        scanner.create(root, verification_file, baseline_format)
+
+def verify(verification_file, root, **settings):
+    with SIV.Verifier(verification_file, **settings) as verifier:
+        return [(change["event"], os.path.relpath(change["path"], root)) for change in verifier.verify(root)]
+
+def write(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+@pytest.mark.parametrize("baseline_format", ["csv", "sqlite"])
+def test_changes_are_found_in_walk_order(tmp_path, tree, baseline_format):
+    verification_file = str(tmp_path / "v")
+    create(tree, verification_file, baseline_format)
+    time.sleep(0.01) # so that the mtime of the modified file changes
+    write(os.path.join(tree, "dir0", "new.txt"), "new\n")
+    os.remove(os.path.join(tree, "dir1", "sub0", "file2.txt"))
+    write(os.path.join(tree, "dir3", "sub1", "file1.txt"), "more\n")
+    shutil.rmtree(os.path.join(tree, "dir5"))
+    write(os.path.join(tree, "aaa.txt"), "first file of the root folder\n")
+    # in every directory the subdirectories (each one followed by its content) come first, then the files
+    expected = [("added", "dir0/new.txt"),
+                ("deleted", "dir1/sub0/file2.txt"),
+                ("modified", "dir3/sub1/file1.txt"),
+                ("deleted", "dir5"),
+                ("deleted", "dir5/sub0"),
+                ("deleted", "dir5/sub0/file0.txt"),
+                ("deleted", "dir5/sub0/file2.txt"),
+                ("deleted", "dir5/sub0/file4.txt"),
+                ("deleted", "dir5/sub1"),
+                ("deleted", "dir5/sub1/file1.txt"),
+                ("deleted", "dir5/sub1/file3.txt"),
+                ("added", "aaa.txt")]
+    assert verify(verification_file, tree) == expected
+    assert verify(verification_file, tree, fast=True) == expected
+
+@pytest.mark.parametrize("baseline_format", ["csv", "sqlite"])
+def test_fast_verification_counts(tmp_path, tree, baseline_format):
+    verification_file = str(tmp_path / "v")
+    create(tree, verification_file, baseline_format)
+    time.sleep(0.01)
+    touched = os.path.join(tree, "dir2", "sub0", "file2.txt")
+    os.utime(touched) # re-hashed, but not reported: its content hasn't changed
+    write(os.path.join(tree, "dir4", "sub1", "file1.txt"), "more\n")
+    report = tmp_path / "report.txt"
+    result = subprocess.run([sys.executable, SIV.__file__, "-v", "-F", "-D", tree, "-V", verification_file, "-R", str(report)],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    text = report.read_text()
+    assert "Fast verification: 29 files have been trusted and 2 files have been re-hashed" in text
+    assert "Overall, 1 warnings have been issued" in text
+    # --paranoid overrides -F: every file is re-hashed
+    subprocess.run([sys.executable, SIV.__file__, "-v", "-F", "-P", "-D", tree, "-V", verification_file, "-R", str(report)],
+                   check=True, capture_output=True)
+    assert "Fast verification" not in report.read_text()
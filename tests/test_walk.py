@@ -0,0 +1,40 @@
+# Tests of the walk of the tree (symbolic link policies)
+import csv
+import io
+import os
+
+import pytest
+
+import SIV
+
+def scan(root, symlinks):
+    metrics = SIV.Metrics()
+    out = io.StringIO()
+    SIV.scan_folder(root, csv.writer(out), metrics=metrics, symlinks=symlinks)
+    rows = {os.path.basename(row[SIV.PATH_COLUMN]): row for row in csv.reader(io.StringIO(out.getvalue()))}
+    return rows, metrics.counts
+
+@pytest.mark.parametrize("symlinks", SIV.SYMLINK_POLICIES)
+def test_symlink_loops_are_recorded_as_links(tmp_path, symlinks):
+    root = tmp_path / "data"
+    root.mkdir()
+    (root / "file").write_text("content\n")
+    os.symlink("self", root / "self")
+    os.symlink("b", root / "a")
+    os.symlink("a", root / "b")
+    rows, _ = scan(str(root), symlinks)
+    assert sorted(rows) == ["a", "b", "file", "self"]
+    for name in ("a", "b", "self"):
+        assert rows[name][6] == SIV.HASH_FUNCTIONS["sha1"](os.readlink(root / name).encode()).hexdigest()
+
+def test_file_reached_through_links_is_hashed_once(tmp_path):
+    root = tmp_path / "data"
+    root.mkdir()
+    (root / "file").write_bytes(os.urandom(100000))
+    os.symlink("file", root / "l1")
+    os.symlink("file", root / "l2")
+    os.symlink(root / "file", root / "a-link-before-its-target")
+    rows, counts = scan(str(root), "follow")
+    assert counts["files hashed"] == 1
+    assert counts["files deduplicated"] == 3
+    assert len({row[6] for row in rows.values()}) == 1
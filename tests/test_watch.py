@@ -0,0 +1,99 @@
+# Tests of watch mode
+import os
+import threading
+import time
+
+import SIV
+
+def test_watch_mode_keeps_the_symlink_policy(tmp_path, capsys):
+    root = tmp_path / "tree"
+    outside = tmp_path / "outside"
+    root.mkdir()
+    outside.mkdir()
+    (outside / "target").write_text("target\n")
+    os.symlink(outside / "target", root / "link")
+    os.symlink(outside, root / "dirlink")
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner(symlinks="record") as scanner:
+        scanner.create(str(root), verification_file)
+    baseline = SIV.open_baseline(verification_file)
+    symlinks, walk_filter = SIV.baseline_walk(baseline, str(root))
+    watcher = SIV.Watcher(str(root), baseline, "sha1", str(tmp_path / "r.txt"), walk_filter=walk_filter, symlinks=symlinks)
+    for name in ("link", "dirlink"):
+        watcher.check(str(root / name))
+    watcher.checkpoint()
+    comparator = watcher.last_checkpoint[2]
+    assert (watcher.comparator.num_modified, watcher.comparator.num_added) == (0, 0)
+    assert (comparator.num_modified, comparator.num_added, comparator.num_deleted) == (0, 0, 0)
+    assert "Warning" not in capsys.readouterr().out
+
+def make_watcher(tmp_path, tree, **settings):
+    verification_file = str(tmp_path / "v")
+    with SIV.Scanner() as scanner:
+        scanner.create(tree, verification_file)
+    return SIV.Watcher(tree, SIV.open_baseline(verification_file), "sha1", str(tmp_path / "report.txt"), **settings)
+
+def test_handle_and_process(tmp_path, tree, capsys):
+    watcher = make_watcher(tmp_path, tree)
+    watcher.add_watches(tree)
+    assert len(watcher.watched) == 20 # the root folder, 6 directories with 2 subdirectories each and empty
+    wd = watcher.watched[os.path.join(tree, "dir0", "sub0")]
+    with open(os.path.join(tree, "dir0", "sub0", "file0.txt"), "a") as f:
+        f.write("changed\n")
+    os.remove(os.path.join(tree, "dir0", "sub0", "file2.txt"))
+    watcher.handle([(wd, SIV.IN_MODIFY, "file0.txt"), (wd, SIV.IN_CLOSE_WRITE, "file0.txt"), (wd, SIV.IN_DELETE, "file2.txt"),
+                    (12345, SIV.IN_MODIFY, "unknown watch")])
+    assert watcher.dirty == {os.path.join(tree, "dir0", "sub0", name) for name in ("file0.txt", "file2.txt")}
+    watcher.process()
+    assert not watcher.dirty
+    assert (watcher.comparator.num_modified, watcher.comparator.num_deleted) == (1, 1)
+    # the same change isn't reported again at the next event of the path
+    watcher.handle([(wd, SIV.IN_ATTRIB, "file0.txt")])
+    watcher.process()
+    assert watcher.comparator.num_modified == 1
+    output = capsys.readouterr().out
+    assert output.count("file0.txt has undergone") == 1 and "file2.txt has been deleted" in output
+
+def test_moved_directory_and_removed_watch(tmp_path, tree):
+    watcher = make_watcher(tmp_path, tree)
+    watcher.add_watches(tree)
+    root_wd = watcher.watched[tree]
+    moved = os.path.join(tree, "dir1")
+    watcher.handle([(root_wd, SIV.IN_MOVED_FROM | SIV.IN_ISDIR, "dir1")])
+    # the watches below a moved directory are dropped, the directory will be rescanned
+    assert not [directory for directory in watcher.watched if directory == moved or directory.startswith(moved + os.sep)]
+    assert moved in watcher.dirty
+    wd = watcher.watched[os.path.join(tree, "dir2")]
+    watcher.handle([(wd, SIV.IN_IGNORED, "")])
+    assert os.path.join(tree, "dir2") not in watcher.watched and wd not in watcher.watches
+
+def test_overflow_rescans_the_tree(tmp_path, tree, monkeypatch):
+    watcher = make_watcher(tmp_path, tree)
+    rescanned = []
+    monkeypatch.setattr(watcher, "rescan", rescanned.append)
+    watcher.dirty.add(os.path.join(tree, "top.txt"))
+    watcher.handle([(-1, SIV.IN_Q_OVERFLOW, "")])
+    watcher.process()
+    assert rescanned == [tree] and not watcher.dirty and not watcher.overflow
+
+def test_run_debounces_bursts_of_events(tmp_path, tree):
+    watcher = make_watcher(tmp_path, tree, debounce=0.3, checkpoint_interval=0)
+    processed = []
+    process = watcher.process
+    def counting_process():
+        processed.append(set(watcher.dirty))
+        process()
+    watcher.process = counting_process
+    path = os.path.join(tree, "dir4", "sub1", "file3.txt")
+    thread = threading.Thread(target=watcher.run, args=(2.5,))
+    thread.start()
+    time.sleep(0.8)
+    for i in range(20): # a burst of writes, processed once when it has calmed down
+        with open(path, "a") as f:
+            f.write(f"{i}\n")
+        time.sleep(0.01)
+    thread.join()
+    assert processed == [{path}]
+    assert watcher.comparator.num_modified == 1
+    report = (tmp_path / "report.txt").read_text()
+    assert "Overall, 1 warnings have been issued in watch mode" in report